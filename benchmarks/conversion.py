@@ -0,0 +1,440 @@
+"""
+Benchmarks of the grammar conversion pipeline.
+
+Times each stage separately (BackusGrammar, every SimplifiedGrammar pass, ChomskyGrammar
+and GreibachGrammar with each strategy, and by components with --workers) on the JSON,
+arithmetic and parenthesis grammars and on synthetic grammars of growing size, with the
+production count and the peak memory of every stage. Results are printed as a table and
+written as JSON with --output, for comparing runs.
+
+Run from the repository root:
+    python -m benchmarks.conversion --sizes 2 4 8 16 --output results.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from piu.grammars.converters.bnf.backus import BackusGrammar
+from piu.grammars.converters.cnf.chomsky import ChomskyGrammar
+from piu.grammars.converters.gnf.greibach import GreibachGrammar
+from piu.grammars.converters.simplifier import SimplifiedGrammar
+from piu.grammars.earley import EarleyParser
+from piu.grammars.element import EmptyElement, RuleRefElement, TerminalElement
+from piu.grammars.gss import GSSParser
+from piu.grammars.parser import BaseParser
+
+JSON_GRAMMAR = r"""
+    value: dict
+         | list
+         | ESCAPED_STRING
+         | SIGNED_NUMBER
+         | "true" | "false" | "null"
+
+    list : "[" [value ("," value)*] "]"
+
+    dict : "{" [pair ("," pair)*] "}"
+    pair : ESCAPED_STRING ":" value
+
+    %import common.ESCAPED_STRING
+    %import common.SIGNED_NUMBER
+    """
+
+ARITHMETIC_GRAMMAR = r"""
+    expr: expr "+" term | expr "-" term | term
+    term: term "*" factor | term "/" factor | factor
+    factor: "-" factor | "(" expr ")" | NUMBER
+
+    %import common.NUMBER
+    """
+
+# in the order of SimplifiedGrammar.simplify
+SIMPLIFY_PASSES = (
+    "add_new_start_symbol",
+    "remove_redundant_non_terminals",
+    "remove_unreachable_symbols",
+    "remove_null_productions",
+    "remove_unit_productions",
+    "sort_rules",
+)
+
+
+def optional_groups(size: int) -> str:
+    """
+    A rule with size optional groups of left-recursive nullable non-terminals
+    """
+    groups = " ".join(f"[o{i}]" for i in range(size))
+    rules = "".join(f'o{i}: "x{i}" | o{i} "y" |\n' for i in range(size))
+    return f'start: "a" {groups} "b"\n' + rules
+
+
+def precedence_levels(size: int) -> str:
+    """
+    An expression grammar with size left-recursive binary operator levels
+    """
+    rules = [f'e{i}: e{i} "o{i}" e{i + 1} | e{i + 1}' for i in range(size)]
+    rules.append(f'e{size}: "(" e0 ")" | "x"')
+    return "\n".join(rules) + "\n"
+
+
+def alternatives(size: int) -> str:
+    """
+    A list of items each being one of size keywords
+    """
+    keywords = " | ".join(f'"k{i}"' for i in range(size))
+    return f'start: item | start "," item\nitem: {keywords}\n'
+
+
+def parenthesis(_: int) -> Tuple[Dict[RuleRefElement, list], RuleRefElement]:
+    start = RuleRefElement("S")
+    grammar = {
+        start: [
+            [start, start],
+            [TerminalElement("(", None), start, TerminalElement(")", None)],
+            [EmptyElement()],
+        ]
+    }
+    return grammar, start
+
+
+def mutual_recursion(_: int) -> Tuple[Dict[RuleRefElement, list], RuleRefElement]:
+    """
+    Left recursion through a nullable non-terminal: N0 starts with N3, which starts
+    with N0 or is empty. Substituting N0 into N3 must keep the left recursion of N0.
+    """
+    n0, n1, n2, n3 = (RuleRefElement(f"N{index}") for index in range(4))
+    a, b = TerminalElement("a", None), TerminalElement("b", None)
+    grammar = {
+        n0: [[n0, a], [n3, a]],
+        n1: [[b]],
+        n2: [[n0]],
+        n3: [[n0, b], [EmptyElement()], [EmptyElement()]],
+    }
+    return grammar, n0
+
+
+# name: (builder of the Lark text or of the grammar dict, start rule, scales with size)
+CORPUS: Dict[str, Tuple[Callable[[int], Any], str, bool]] = {
+    "json": (lambda _: JSON_GRAMMAR, "value", False),
+    "arithmetic": (lambda _: ARITHMETIC_GRAMMAR, "expr", False),
+    "parenthesis": (parenthesis, "S", False),
+    "mutual_recursion": (mutual_recursion, "N0", False),
+    "optional_groups": (optional_groups, "start", True),
+    "precedence_levels": (precedence_levels, "e0", True),
+    "alternatives": (alternatives, "start", True),
+}
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Tuple[Any, float, int]:
+    """
+    The result, the best time out of repeat runs and the peak memory of one more run
+    traced by tracemalloc, which would slow down the timed runs
+    """
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def source_grammar(name: str, size: int):
+    build, start, _ = CORPUS[name]
+    source = build(size)
+    if isinstance(source, str):
+        return source, start
+    return source
+
+
+def stage_result(stage: str, seconds: float, peak: int, grammar) -> dict:
+    return {
+        "stage": stage,
+        "seconds": seconds,
+        "peak_bytes": peak,
+        "productions": len(grammar.rules),
+    }
+
+
+def language(parser: BaseParser, length: int) -> Set[Tuple[str, ...]]:
+    """
+    The sentences of up to length terminals the parser accepts, by terminal name. The
+    empty terminal of a GNF start symbol is left out of the sentences.
+    """
+    grammar = parser.grammar
+    sentences: Set[Tuple[str, ...]] = set()
+    pending = [(parser, ())]
+    while pending:
+        parser, sentence = pending.pop()
+        if parser.accepts_end():
+            sentences.add(sentence)
+        if len(sentence) == length:
+            continue
+        for terminal in dict.fromkeys(parser.top_symbols()):
+            if terminal == grammar.END_ID:
+                continue
+            child = parser.fork()
+            child.add_terminal(terminal)
+            element = grammar.symbols[terminal]
+            if isinstance(element, EmptyElement):
+                pending.append((child, sentence))
+            else:
+                pending.append((child, sentence + (element.value,)))
+    return sentences
+
+
+def mismatches(source: tuple, gnf: GreibachGrammar, length: int) -> List[str]:
+    """
+    The sentences of up to length terminals accepted by only one of the source grammar,
+    run by the Earley parser, and the GNF grammar
+    """
+    expected = language(EarleyParser(*source, verbose=False), length)
+    accepted = language(
+        GSSParser(gnf.export_grammar(), gnf.start_symbol, verbose=False), length
+    )
+    return sorted(" ".join(sentence) for sentence in expected ^ accepted)
+
+
+def run_front(name: str, size: int, repeat: int, report: Callable[[dict], None]):
+    """
+    BackusGrammar, the simplifier passes and ChomskyGrammar
+    """
+    source = source_grammar(name, size)
+    if isinstance(source[0], str):
+        text, start = source
+        bnf, seconds, peak = measure(lambda: BackusGrammar(text, start=start), repeat)
+        report(stage_result("bnf", seconds, peak, bnf))
+        source = bnf.export_grammar(), bnf.start_symbol
+
+    for method in SIMPLIFY_PASSES:
+        # the passes before it run on every repeat, so its own time is taken inside
+        passes = [timed_pass(source, method) for _ in range(repeat)]
+        simplified, _, peak = measure(partial(timed_pass, source, method), 1)
+        seconds = min(seconds for _, seconds in passes)
+        report(stage_result(f"simplify.{method}", seconds, peak, simplified[0]))
+
+    cnf, seconds, peak = measure(lambda: ChomskyGrammar(*source), repeat)
+    report(stage_result("cnf", seconds, peak, cnf))
+
+
+def timed_pass(source: tuple, method: str) -> Tuple[SimplifiedGrammar, float]:
+    """
+    Run the simplifier passes up to method, timing only method
+    """
+    simplified = SimplifiedGrammar(*source)
+    for previous in SIMPLIFY_PASSES[: SIMPLIFY_PASSES.index(method)]:
+        getattr(simplified, previous)()
+    start = time.perf_counter()
+    getattr(simplified, method)()
+    return simplified, time.perf_counter() - start
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+def run_gnf(
+    name: str,
+    size: int,
+    repeat: int,
+    report: Callable[[dict], None],
+    strategy: str,
+    workers: Optional[int] = None,
+    check: int = 0,
+):
+    source = source_grammar(name, size)
+    if isinstance(source[0], str):
+        bnf = BackusGrammar(source[0], start=source[1])
+        source = bnf.export_grammar(), bnf.start_symbol
+    cnf = ChomskyGrammar(*source)
+    grammar, start_symbol = cnf.export_grammar(), cnf.start_symbol
+    gnf, seconds, peak = measure(
+        lambda: GreibachGrammar(
+            grammar, start_symbol, strategy=strategy, workers=workers
+        ),
+        repeat,
+    )
+    stage = f"gnf.{strategy}" if workers is None else f"gnf.components.{workers}"
+    result = stage_result(stage, seconds, peak, gnf)
+    if check:
+        result["mismatches"] = mismatches(source, gnf, check)
+    report(result)
+
+
+def _child(target: Callable, args: tuple, queue: multiprocessing.Queue):
+    try:
+        target(*args, queue.put)
+    except Exception as exception:  # pylint: disable=broad-exception-caught
+        queue.put({"stage": "error", "status": "error", "error": repr(exception)})
+    queue.put(None)
+
+
+def run_isolated(
+    target: Callable, args: tuple, timeout: float, pending_stage: str
+) -> List[dict]:
+    """
+    Run a benchmark in a child process, so a conversion that blows up is stopped after
+    timeout seconds without losing the stages it finished
+    """
+    queue: multiprocessing.Queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(target, args, queue))
+    process.start()
+    results: List[dict] = []
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            result = queue.get(timeout=max(remaining, 0.01))
+        except Exception:  # pylint: disable=broad-exception-caught
+            process.terminate()
+            results.append({"stage": pending_stage, "status": "timeout"})
+            break
+        if result is None:
+            break
+        results.append(result)
+    process.join()
+    return results
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def run(
+    names: List[str],
+    sizes: List[int],
+    repeat: int,
+    timeout: float,
+    workers: Optional[List[int]] = None,
+    check: int = 0,
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for name in names:
+        for size in sizes if CORPUS[name][2] else [None]:
+            # partial objects of module functions are picklable for the child process
+            runs: List[Tuple[Callable, str]] = [(run_front, "front")]
+            runs += [
+                (partial(run_gnf, strategy=strategy, check=check), f"gnf.{strategy}")
+                for strategy in GreibachGrammar.STRATEGIES
+            ]
+            runs += [
+                (
+                    partial(
+                        run_gnf, strategy="substitution", workers=count, check=check
+                    ),
+                    f"gnf.components.{count}",
+                )
+                for count in workers or []
+            ]
+            for target, stage in runs:
+                args = (name, size, repeat)
+                for result in run_isolated(target, args, timeout, stage):
+                    result = {"grammar": name, "size": size, "status": "ok", **result}
+                    results.append(result)
+                    print_row(result, results)
+    return results
+
+
+def growth(result: Dict[str, Any], results: List[Dict[str, Any]]) -> Optional[float]:
+    """
+    The exponent k of time ~ size^k from the previous size of the same grammar and stage
+    """
+    if result["size"] is None or "seconds" not in result:
+        return None
+    previous = [
+        other
+        for other in results
+        if other["grammar"] == result["grammar"]
+        and other["stage"] == result["stage"]
+        and other.get("seconds")
+        and other["size"] is not None
+        and other["size"] < result["size"]
+    ]
+    if not previous or not result["seconds"]:
+        return None
+    other = previous[-1]
+    return math.log(result["seconds"] / other["seconds"]) / math.log(
+        result["size"] / other["size"]
+    )
+
+
+def print_row(result: Dict[str, Any], results: List[Dict[str, Any]]):
+    size = "" if result["size"] is None else result["size"]
+    if "seconds" not in result:
+        detail = result.get("error", result["status"])
+        print(f"{result['grammar']:<18} {size:>5} {result['stage']:<42} {detail}")
+        return
+    exponent = growth(result, results)
+    print(
+        f"{result['grammar']:<18} {size:>5} {result['stage']:<42} "
+        f"{result['seconds'] * 1000:>10.2f} ms {result['peak_bytes'] / 1024:>10.0f} KiB "
+        f"{result['productions']:>8} rules"
+        + ("" if exponent is None else f"   x size^{exponent:.2f}")
+        + (
+            ""
+            if "mismatches" not in result
+            else f"   {len(result['mismatches'])} mismatches"
+        )
+    )
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--grammars", nargs="+", choices=list(CORPUS), default=list(CORPUS)
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[2, 4, 8, 16])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="seconds before a run is stopped"
+    )
+    parser.add_argument(
+        "--workers",
+        nargs="+",
+        type=int,
+        default=[],
+        help="also convert by components with these process counts, 0 for one per CPU",
+    )
+    parser.add_argument(
+        "--check",
+        type=int,
+        default=0,
+        help="compare the sentences of up to this many terminals every GNF grammar "
+        "accepts with an Earley parser of the source grammar",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(
+        args.grammars,
+        sorted(args.sizes),
+        max(args.repeat, 1),
+        args.timeout,
+        args.workers,
+        args.check,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
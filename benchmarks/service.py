@@ -0,0 +1,176 @@
+"""
+Throughput of the asyncio DecodingService as the number of concurrent sessions grows.
+
+Every session is a local in-process client generating JSON with a synthetic
+vocabulary: it asks for the allowed tokens, picks one at random and feeds it, for a
+fixed number of steps or until only the end of input is allowed. The grammar is
+compiled once, before the runs. Results are printed as a table and written as JSON with
+--output, for comparing runs.
+
+Run from the repository root:
+    python -m benchmarks.service --sessions 1 4 16 64 --steps 32 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.conversion import JSON_GRAMMAR
+from piu.grammars.grammar_cache import GrammarCache
+from piu.processors.service import DecodingService
+
+SAMPLE = '{"name": "piu", "values": [1, -2.5, 3e10], "ok": true, "next": null}'
+
+# the JSON grammar of the conversion benchmark has no whitespace
+JSON_TEXT = SAMPLE.replace(" ", "")
+
+
+def vocabulary(max_length: int) -> List[str]:
+    """
+    Every char of the sample and its substrings of up to max_length chars, plus letters
+    and digits for the string and number bodies. The last token stands for EOS.
+    """
+    tokens = dict.fromkeys("abcdefghijklmnopqrstuvwxyz0123456789")
+    for length in range(1, max_length + 1):
+        for start in range(len(JSON_TEXT) - length + 1):
+            tokens[JSON_TEXT[start : start + length]] = None
+    return list(tokens) + [""]
+
+
+async def client(
+    service: DecodingService,
+    tokens: List[str],
+    steps: int,
+    seed: int,
+    latencies: List[float],
+) -> int:
+    """
+    Generate up to steps tokens in one session, returning the number generated
+    """
+    rng = random.Random(seed)
+    session = await service.open_session(JSON_GRAMMAR, "value")
+    generated = 0
+    try:
+        for _ in range(steps):
+            start = time.perf_counter()
+            token_ids = await session.allowed_token_ids()
+            token_ids = [
+                token_id for token_id in token_ids if token_id != service.eos_token_id
+            ]
+            if not token_ids:
+                break
+            await session.advance(tokens[rng.choice(token_ids)])
+            latencies.append(time.perf_counter() - start)
+            generated += 1
+    finally:
+        session.close()
+    return generated
+
+
+async def run_level(
+    grammar_cache: GrammarCache,
+    tokens: List[str],
+    sessions: int,
+    steps: int,
+    max_pending: int,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    async with DecodingService(
+        tokens,
+        eos_token_id=len(tokens) - 1,
+        grammar_cache=grammar_cache,
+        max_pending=max_pending,
+    ) as service:
+        start = time.perf_counter()
+        generated = await asyncio.gather(
+            *(
+                client(service, tokens, steps, seed, latencies)
+                for seed in range(sessions)
+            )
+        )
+        seconds = time.perf_counter() - start
+        jobs = service.stats()["jobs"]
+    latencies.sort()
+    return {
+        "sessions": sessions,
+        "tokens": sum(generated),
+        "seconds": seconds,
+        "tokens_per_second": sum(generated) / seconds if seconds else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        # nearest rank: the smallest latency at least 99% of the steps did not exceed
+        "p99_ms": (
+            latencies[math.ceil(0.99 * len(latencies)) - 1] * 1000
+            if latencies
+            else None
+        ),
+        "jobs": jobs,
+    }
+
+
+def print_row(result: Dict[str, Any]):
+    print(
+        f"{result['sessions']:>8} {result['tokens']:>8} {result['seconds']:>9.2f} s "
+        f"{result['tokens_per_second']:>10.1f} tok/s "
+        f"p50 {result['p50_ms'] or 0:>8.2f} ms p99 {result['p99_ms'] or 0:>8.2f} ms"
+    )
+    sys.stdout.flush()
+
+
+async def run(
+    sessions: List[int], steps: int, max_length: int, max_pending: int
+) -> List[Dict[str, Any]]:
+    tokens = vocabulary(max_length)
+    grammar_cache = GrammarCache()
+    start = time.perf_counter()
+    grammar_cache.get(JSON_GRAMMAR, "value")
+    print(
+        f"compiled in {time.perf_counter() - start:.2f} s, {len(tokens)} tokens",
+    )
+    results = []
+    for count in sessions:
+        result = await run_level(grammar_cache, tokens, count, steps, max_pending)
+        results.append(result)
+        print_row(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--steps", type=int, default=32, help="tokens per session")
+    parser.add_argument(
+        "--max-length", type=int, default=4, help="longest token of the vocabulary"
+    )
+    parser.add_argument(
+        "--max-pending", type=int, default=64, help="jobs submitted at once"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        run(sorted(args.sessions), args.steps, args.max_length, args.max_pending)
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "steps": args.steps,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
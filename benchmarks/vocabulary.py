@@ -0,0 +1,185 @@
+"""
+Time of one TokenLogitsProcessor step with a large vocabulary on the JSON grammar.
+
+The vocabulary is synthetic but shaped like a BPE one: words with and without a leading
+space, capitalized and quoted, runs of JSON punctuation, numbers and some non-ASCII
+chars. Every step is cold (a new processor and an empty StateCache), at positions
+ranging from structural chars, where few tokens are allowed, to the inside of a string,
+where most are. Results are printed as a table and written as JSON with --output.
+
+Run from the repository root:
+    python -m benchmarks.vocabulary --tokens 50000 150000 --output results.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from typing import Any, Dict, List, Type
+
+from benchmarks.conversion import JSON_GRAMMAR
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.grammar_cache import compile_grammar
+from piu.grammars.gss import GSSParser
+from piu.grammars.parser import BaseParser, Parser
+from piu.processors.vocabulary import TokenLogitsProcessor
+
+# label: text fed before the step, the JSON grammar having no whitespace
+POSITIONS = {
+    "string body": '{"name":"pi',
+    "string start": '{"name":"',
+    "key start": "{",
+    "number": '{"n":-12',
+    "after value": '{"n":[true',
+}
+
+PARSERS: Dict[str, Type[BaseParser]] = {"gss": GSSParser, "parser": Parser}
+
+LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+PUNCTUATION = '{}[]:,"'
+
+
+def vocabulary(size: int, seed: int = 0) -> List[str]:
+    """
+    size distinct tokens, the last one standing for EOS
+    """
+    rng = random.Random(seed)
+    tokens: Dict[str, None] = dict.fromkeys(chr(code) for code in range(32, 127))
+    for first in PUNCTUATION:
+        for second in PUNCTUATION:
+            tokens[first + second] = None
+            for third in PUNCTUATION:
+                tokens[first + second + third] = None
+    for number in range(1000):
+        tokens[str(number)] = None
+    while len(tokens) < size - 1:
+        kind = rng.random()
+        if kind < 0.03:
+            tokens["".join(chr(rng.randrange(0xA0, 0x3000)) for _ in range(2))] = None
+            continue
+        word = "".join(
+            rng.choice(LETTERS[: rng.choice((8, 16, 26))])
+            for _ in range(rng.randint(2, 10))
+        )
+        if kind < 0.4:
+            word = " " + word
+        elif kind < 0.5:
+            word = word.capitalize()
+        elif kind < 0.6:
+            word = '"' + word
+        elif kind < 0.65:
+            word = word + '":'
+        elif kind < 0.7:
+            word = word + '",'
+        tokens[word] = None
+    return list(tokens)[: size - 1] + [""]
+
+
+def brute_force(parser: BaseParser, tokens: List[str]) -> List[int]:
+    """
+    The tokens accepted by feeding each one to its own fork
+    """
+    return [
+        token_id
+        for token_id, token in enumerate(tokens)
+        if token and parser.fork().feed(token) == len(token)
+    ]
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def run_step(
+    grammar: CompiledGrammar,
+    parser_class: Type[BaseParser],
+    tokens: List[str],
+    text: str,
+    repeat: int,
+    verify: bool,
+) -> Dict[str, Any]:
+    best = float("inf")
+    token_ids: List[int] = []
+    for _ in range(repeat):
+        cache = StateCache()
+        parser = parser_class(grammar, grammar.start_symbol, verbose=False, cache=cache)
+        parser.add_text(text)
+        processor = TokenLogitsProcessor(tokens, len(tokens) - 1, cache)
+        start = time.perf_counter()
+        token_ids = processor.allowed_token_ids(parser)
+        best = min(best, time.perf_counter() - start)
+    result: Dict[str, Any] = {"seconds": best, "allowed": len(token_ids)}
+    if verify:
+        expected = brute_force(parser, tokens)
+        if parser.accepts_end():
+            expected.append(len(tokens) - 1)
+        result["mismatches"] = len(set(expected) ^ set(token_ids))
+    return result
+
+
+def print_row(result: Dict[str, Any]):
+    mismatches = result.get("mismatches")
+    print(
+        f"{result['tokens']:>8} {result['parser']:<8} {result['position']:<14} "
+        f"{result['seconds'] * 1000:>10.2f} ms {result['allowed']:>8} allowed"
+        + (f" {mismatches:>5} mismatches" if mismatches is not None else "")
+    )
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", nargs="+", type=int, default=[50000, 150000])
+    parser.add_argument(
+        "--parsers", nargs="+", choices=list(PARSERS), default=list(PARSERS)
+    )
+    parser.add_argument(
+        "--positions", nargs="+", choices=list(POSITIONS), default=list(POSITIONS)
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="timed cold steps")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="compare the allowed tokens with feeding every token on its own",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    grammar = compile_grammar(JSON_GRAMMAR, "value")
+    results = []
+    for size in args.tokens:
+        tokens = vocabulary(size)
+        for name in args.parsers:
+            for position in args.positions:
+                result = {
+                    "tokens": size,
+                    "parser": name,
+                    "position": position,
+                    **run_step(
+                        grammar,
+                        PARSERS[name],
+                        tokens,
+                        POSITIONS[position],
+                        args.repeat,
+                        args.verify,
+                    ),
+                }
+                results.append(result)
+                print_row(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
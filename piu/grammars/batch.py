@@ -0,0 +1,109 @@
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple, Type, Union
+
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.element import RuleRefElement
+from piu.grammars.gss import GSSParser
+from piu.grammars.mask import MaskWriter
+from piu.grammars.parser import BaseParser, Stack
+from piu.exceptions.base import GrammarException
+
+
+class BatchParser:
+    """
+    The parser states of a whole decoding batch, advanced together one terminal per
+    sequence and step.
+
+    Sequences that are in the same parser state share one state object: after every
+    step, states with equal fingerprints are merged. A step advances every distinct
+    (state, terminal) pair once and computes the allowed mask of every distinct state
+    once; the remaining rows are block copies of it.
+    A sequence that consumed the end of input (CompiledGrammar.END_ID) is finished and
+    from then on only allows, and accepts, the end of input again.
+    """
+
+    def __init__(
+        self,
+        grammar: Union[Dict[RuleRefElement, List[Stack]], CompiledGrammar],
+        initial_rule: RuleRefElement,
+        batch_size: int,
+        parser_class: Type[BaseParser] = GSSParser,
+        cache: Optional[StateCache] = None,
+    ):
+        initial = parser_class(grammar, initial_rule, verbose=False, cache=cache)
+        self.grammar = initial.grammar
+        self.batch_size = batch_size
+        # None marks a finished sequence
+        self.states: List[Optional[BaseParser]] = [initial] * batch_size
+        self._mask: Optional[MaskWriter] = None
+
+    def step(self, symbols: Sequence[int], out: Any = None) -> Any:
+        """
+        Consume symbols[i], a terminal id, for every sequence i and return the
+        batch_size x num_terminals allowed mask (see allowed_masks)
+        """
+        if len(symbols) != self.batch_size:
+            raise ValueError(f"Expected {self.batch_size} symbols, got {len(symbols)}")
+
+        advanced: Dict[Tuple[int, int], Optional[BaseParser]] = {}
+        merged: Dict[Hashable, BaseParser] = {}
+        states: List[Optional[BaseParser]] = []
+        for index, (state, symbol) in enumerate(zip(self.states, symbols)):
+            symbol = int(symbol)
+            key = (id(state), symbol)
+            if key not in advanced:
+                next_state = self._advance(state, symbol, index)
+                if next_state is not None:
+                    next_state = merged.setdefault(next_state.fingerprint(), next_state)
+                advanced[key] = next_state
+            states.append(advanced[key])
+        self.states = states
+
+        return self.allowed_masks(out)
+
+    def _advance(
+        self, state: Optional[BaseParser], symbol: int, index: int
+    ) -> Optional[BaseParser]:
+        if symbol == CompiledGrammar.END_ID:
+            if state is None or CompiledGrammar.END_ID in state.top_symbols():
+                return None
+        elif state is not None:
+            next_state = state.fork()
+            try:
+                next_state.add_terminal(symbol)
+                return next_state
+            except GrammarException:
+                pass
+        raise GrammarException(
+            f"The symbol {symbol} is not accepted by the grammar in sequence {index}"
+        )
+
+    def allowed_masks(self, out: Any = None) -> Any:
+        """
+        Fill the row i of out with the allowed mask of sequence i, indexed by terminal id.
+        out is a C-contiguous batch_size x num_terminals one byte per entry buffer
+        (e.g. a NumPy bool array) or a flat buffer of that size; a new bytearray is
+        returned when it is omitted.
+        """
+        width = self.grammar.num_terminals
+        if out is None:
+            out = bytearray(self.batch_size * width)
+        if self._mask is None or self._mask.out is not out:
+            self._mask = MaskWriter(out)
+        view = self._mask.view
+        self._mask.clear()
+
+        rows: Dict[int, int] = {}
+        for index, state in enumerate(self.states):
+            start = index * width
+            first = rows.get(id(state))
+            if first is not None:
+                view[start : start + width] = view[first : first + width]
+                continue
+            rows[id(state)] = start
+            if state is None:
+                view[start + CompiledGrammar.END_ID] = 1
+            else:
+                for symbol in state.top_symbols():
+                    view[start + symbol] = 1
+        return out
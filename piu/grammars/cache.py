@@ -0,0 +1,78 @@
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class StateCache:
+    """
+    A bounded LRU cache from parser state fingerprints (see BaseParser.fingerprint) to
+    results computed for that state, such as allowed masks and transitions.
+
+    Entries are evicted, least recently used first, once there are more than
+    max_entries of them or their estimated size exceeds max_bytes. A cache must only be
+    shared by parsers of the same compiled grammar, since fingerprints are made of
+    symbol ids.
+
+    Only max_entries bounds the memory kept alive by the cache. The size of an entry is
+    the shallow size of its value unless put is given one, which is exact for masks
+    and token id tuples, but a cached transition counts only the list of its stacks:
+    the stack cells, GSS nodes or Earley sets it shares with other states are not
+    counted, so max_bytes is not a bound on them.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Return the cached value or None, counting a hit or a miss
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        """
+        Store a value; size is its estimated footprint in bytes, the shallow
+        sys.getsizeof by default
+        """
+        if size is None:
+            size = sys.getsizeof(value)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,170 @@
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from piu.grammars.dfa import DFA
+from piu.grammars.element import Element, EndElement, RuleRefElement, TerminalElement
+
+
+# pylint: disable=too-many-instance-attributes
+class CompiledGrammar:
+    """
+    A GNF grammar compiled into integer tables for the runtime parser.
+
+    Every terminal and non-terminal is interned to a dense integer id. Terminals take
+    the ids [0, num_terminals), id 0 being the end marker, and non-terminals take the
+    ids [num_terminals, num_symbols).
+
+    Productions are flattened into contiguous buffers:
+    the productions of non-terminal n are range(rule_offsets[i], rule_offsets[i + 1])
+    with i = n - num_terminals, and the symbols of production p are
+    prod_symbols[prod_offsets[p]:prod_offsets[p + 1]].
+    The end marker is appended to every production of the start symbol.
+
+    dfas[t] matches terminal t char by char: its Lark pattern when it has a
+    definition, its value as a literal otherwise. The end marker has no DFA.
+
+    prediction(n) is the row of non-terminal n in the terminal x non-terminal prediction
+    table, and is_ll1(n) tells whether the row has one production per terminal.
+    """
+
+    END_ID = 0
+
+    def __init__(
+        self,
+        grammar: Dict[RuleRefElement, List[List[Element]]],
+        start_symbol: RuleRefElement,
+    ):
+        self.symbols: List[Element] = [EndElement()]
+        self.symbol_ids: Dict[Element, int] = {self.symbols[0]: self.END_ID}
+
+        # dicts keep the first-seen order and give O(1) membership checks
+        terminals: Dict[Element, None] = {}
+        non_terminals: Dict[RuleRefElement, None] = dict.fromkeys(grammar)
+        for seqs in grammar.values():
+            for seq in seqs:
+                for el in seq:
+                    if isinstance(el, RuleRefElement):
+                        non_terminals.setdefault(el)
+                    elif el not in self.symbol_ids:
+                        terminals.setdefault(el)
+        non_terminals.setdefault(start_symbol)
+
+        for el in list(terminals) + list(non_terminals):
+            self.symbol_ids[el] = len(self.symbols)
+            self.symbols.append(el)
+
+        self.num_terminals = len(terminals) + 1
+        self.num_symbols = len(self.symbols)
+        self.start_id = self.symbol_ids[start_symbol]
+
+        self.terminal_ids: Dict[str, int] = {
+            el.value: self.symbol_ids[el] for el in terminals
+        }
+
+        self.dfas: List[Optional[DFA]] = [None]
+        dfas: Dict[str, DFA] = {}
+        for el in terminals:
+            regex = self.terminal_regex(el)
+            if regex not in dfas:
+                dfas[regex] = DFA.from_regex(regex)
+            self.dfas.append(dfas[regex])
+
+        self.rule_offsets = array("i", [0])
+        self.prod_offsets = array("i", [0])
+        self.prod_symbols = array("i")
+        for non_terminal in non_terminals:
+            for seq in grammar.get(non_terminal, []):
+                self.prod_symbols.extend(self.symbol_ids[el] for el in seq)
+                if non_terminal == start_symbol:
+                    self.prod_symbols.append(self.END_ID)
+                self.prod_offsets.append(len(self.prod_symbols))
+            self.rule_offsets.append(len(self.prod_offsets) - 1)
+
+        self._expansions: Dict[int, Tuple[Tuple[int, ...], ...]] = {}
+        self._predictions: Dict[int, Dict[int, Tuple[Tuple[int, ...], ...]]] = {}
+
+    @staticmethod
+    def terminal_regex(terminal: Element) -> str:
+        if isinstance(terminal, TerminalElement) and terminal.definition is not None:
+            return terminal.definition.pattern.to_regexp()
+        return re.escape(terminal.value)
+
+    @property
+    def start_symbol(self) -> RuleRefElement:
+        return self.symbols[self.start_id]
+
+    @property
+    def num_productions(self) -> int:
+        return len(self.prod_offsets) - 1
+
+    def is_terminal(self, symbol: int) -> bool:
+        return symbol < self.num_terminals
+
+    def productions(self, non_terminal: int) -> range:
+        index = non_terminal - self.num_terminals
+        return range(self.rule_offsets[index], self.rule_offsets[index + 1])
+
+    def production(self, production: int) -> array:
+        return self.prod_symbols[
+            self.prod_offsets[production] : self.prod_offsets[production + 1]
+        ]
+
+    def expansions(self, non_terminal: int) -> Tuple[Tuple[int, ...], ...]:
+        """
+        The productions of a non-terminal in stack order (last symbol first), ready to be
+        concatenated onto a stack whose top is its last element.
+        They are built from the flat buffers the first time a non-terminal is expanded.
+        """
+        expansions = self._expansions.get(non_terminal)
+        if expansions is None:
+            expansions = tuple(
+                tuple(reversed(self.production(production)))
+                for production in self.productions(non_terminal)
+            )
+            self._expansions[non_terminal] = expansions
+        return expansions
+
+    def prediction(self, non_terminal: int) -> Dict[int, Tuple[Tuple[int, ...], ...]]:
+        """
+        The row of a non-terminal in the prediction table: its productions in stack
+        order (see expansions) by their first terminal. In GNF every production starts
+        with a terminal, so the next terminal picks the productions to expand.
+        Rows are built the first time they are asked for.
+        """
+        row = self._predictions.get(non_terminal)
+        if row is None:
+            grouped: Dict[int, List[Tuple[int, ...]]] = {}
+            for seq in self.expansions(non_terminal):
+                grouped.setdefault(seq[-1], []).append(seq)
+            row = {terminal: tuple(seqs) for terminal, seqs in grouped.items()}
+            self._predictions[non_terminal] = row
+        return row
+
+    def is_ll1(self, non_terminal: Optional[int] = None) -> bool:
+        """
+        Whether a non-terminal, or every one when none is given, is LL(1): each of its
+        productions starts with a different terminal, so the next terminal alone picks
+        the production
+        """
+        if non_terminal is None:
+            return all(
+                self.is_ll1(symbol)
+                for symbol in range(self.num_terminals, self.num_symbols)
+            )
+        return all(len(seqs) == 1 for seqs in self.prediction(non_terminal).values())
+
+    def is_gnf(self) -> bool:
+        for production in range(self.num_productions):
+            start, end = (
+                self.prod_offsets[production],
+                self.prod_offsets[production + 1],
+            )
+            if start == end:
+                return False
+            if not isinstance(self.symbols[self.prod_symbols[start]], TerminalElement):
+                return False
+        return True
+
+    def decode(self, symbols: Tuple[int, ...]) -> List[Element]:
+        return [self.symbols[symbol] for symbol in symbols]
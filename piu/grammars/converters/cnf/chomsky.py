@@ -1,8 +1,7 @@
-import copy
-import inspect
-from typing import List, Dict
+from typing import Dict, List, Optional, Sequence, Tuple
+from piu.grammars.converters.hooks import ConversionHook, conversion_pass
 from piu.grammars.converters.simplifier import SimplifiedGrammar
-from piu.grammars.converters.rule import Rule, ElementList
+from piu.grammars.converters.rule import Rule
 from piu.grammars.converters.type import GeneralGrammar
 from piu.grammars.converters.utils import DEBUG
 from piu.grammars.element import RuleRefElement, EmptyElement, TerminalElement, Element
@@ -10,8 +9,14 @@ from piu.grammars.element import RuleRefElement, EmptyElement, TerminalElement,
 
 class ChomskyGrammar(SimplifiedGrammar):
 
-    def __init__(self, grammar: GeneralGrammar, start_symbol: RuleRefElement):
-        super().__init__(grammar, start_symbol)
+    def __init__(
+        self,
+        grammar: GeneralGrammar,
+        start_symbol: RuleRefElement,
+        record_timeline: bool = DEBUG,
+        hooks: Sequence[ConversionHook] = (),
+    ):
+        super().__init__(grammar, start_symbol, record_timeline, hooks)
 
         self.add_new_start_symbol()
         self.remove_null_productions()
@@ -21,11 +26,11 @@ class ChomskyGrammar(SimplifiedGrammar):
         self.remove_unreachable_symbols()
         self.sort_rules()
 
-    # pylint: disable=too-many-branches
+    @conversion_pass
     def convert(self):
 
         singles: Dict[TerminalElement, RuleRefElement] = {}
-        multis: Dict[List[Element], RuleRefElement] = {}
+        multis: Dict[Tuple[Element, ...], RuleRefElement] = {}
 
         for lhs in sorted(self.non_terminals):
             rules = self[lhs]
@@ -38,43 +43,40 @@ class ChomskyGrammar(SimplifiedGrammar):
 
             if len(rules) == 1:
                 multis[rules[0].rhs] = lhs
-        # pylint: disable=too-many-nested-blocks
+
+        # rules are immutable: rewritten ones keep their position, new ones go last
+        rewritten: Dict[Rule, Optional[Rule]] = {}
+        new_rules: List[Rule] = []
+
+        def new_non_terminal(rhs: Tuple[Element, ...]) -> RuleRefElement:
+            non_terminal = RuleRefElement(f"RRE_{len(self.non_terminals)}")
+            self.non_terminals.add(non_terminal)
+            new_rules.append(Rule(non_terminal, rhs))
+            return non_terminal
+
+        def single(el: Element) -> Element:
+            if not isinstance(el, TerminalElement):
+                return el
+            if el not in singles:
+                singles[el] = new_non_terminal((el,))
+            return singles[el]
+
         for lhs in sorted(self.non_terminals.copy()):
-            rules = self[lhs]
-            for rule in rules:
+            for rule in self[lhs]:
                 if len(rule.rhs) == 2:
-                    for index, el in enumerate(rule.rhs):
-                        if isinstance(el, TerminalElement):
-                            if el not in singles:
-                                new_non_terminal = RuleRefElement(
-                                    f"RRE_{len(self.non_terminals)}"
-                                )
-                                self.non_terminals.add(new_non_terminal)
-                                self.rules.append(Rule(new_non_terminal, [el]))
-                                singles[el] = new_non_terminal
-                            rule.rhs[index] = singles[el]
+                    rhs = tuple(single(el) for el in rule.rhs)
+                    if rhs != rule.rhs:
+                        rewritten[rule] = Rule(lhs, rhs)
 
                 elif len(rule.rhs) > 2:
-                    last = rule.rhs[-1]
-                    if isinstance(last, TerminalElement):
-                        if last not in singles:
-                            new_non_terminal = RuleRefElement(
-                                f"RRE_{len(self.non_terminals)}"
-                            )
-                            self.non_terminals.add(new_non_terminal)
-                            self.rules.append(Rule(new_non_terminal, [last]))
-                            singles[last] = new_non_terminal
-                        rule.rhs[-1] = singles[last]
-                    term = ElementList(rule.rhs[:-1])
+                    last = single(rule.rhs[-1])
+                    term = rule.rhs[:-1]
                     if term not in multis:
-                        new_non_terminal = RuleRefElement(
-                            f"RRE_{len(self.non_terminals)}"
-                        )
-                        self.non_terminals.add(new_non_terminal)
-                        self.rules.append(Rule(new_non_terminal, term))
-                        multis[term] = new_non_terminal
-                    self.rules.append(Rule(lhs, [multis[term], last]))
-                    self.rules.remove(rule)
+                        multis[term] = new_non_terminal(term)
+                    new_rules.append(Rule(lhs, (multis[term], last)))
+                    rewritten[rule] = None
+
+        kept = (rewritten.get(rule, rule) for rule in self.rules)
+        self.rules = [rule for rule in kept if rule is not None] + new_rules
 
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+        self.record_pass("convert")
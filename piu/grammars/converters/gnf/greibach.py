@@ -1,33 +1,74 @@
-import copy
-import inspect
-from typing import List, Dict
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable, List, Dict, Optional, Sequence, Set, Tuple
+from piu.exceptions.base import GrammarException
+from piu.grammars.converters.hooks import ConversionHook, conversion_pass
 from piu.grammars.converters.simplifier import SimplifiedGrammar
-from piu.grammars.converters.rule import Rule
+from piu.grammars.converters.rule import Rule, RuleWorklist
 from piu.grammars.converters.type import GeneralGrammar
-from piu.grammars.converters.utils import DEBUG
-from piu.grammars.element import RuleRefElement
+from piu.grammars.converters.utils import DEBUG, strongly_connected_components
+from piu.grammars.element import Element, EmptyElement, RuleRefElement
 
 
 class GreibachGrammar(SimplifiedGrammar):
+    """
+    Convert a grammar to Greibach normal form with one of two strategies:
 
-    def __init__(self, grammar: GeneralGrammar, start_symbol: RuleRefElement):
-        super().__init__(grammar, start_symbol)
+    substitution: order the non-terminals, substitute lower ones into the first
+    position of higher ones and remove the direct left recursion of each one before
+    it is substituted in turn (Paull's algorithm).
+    The output can grow exponentially with the number of non-terminals.
+    With workers set, the substitution runs on each strongly connected component of
+    the left-corner graph on its own, in a pool of that many processes (see
+    convert_components).
 
+    left_corner: remove left recursion with the left-corner transform, then substitute
+    first symbols once. The output stays polynomial in the size of the grammar.
+    """
+
+    STRATEGIES = ("substitution", "left_corner")
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        grammar: GeneralGrammar,
+        start_symbol: RuleRefElement,
+        strategy: str = "substitution",
+        record_timeline: bool = DEBUG,
+        hooks: Sequence[ConversionHook] = (),
+        workers: Optional[int] = None,
+    ):
+        if strategy not in self.STRATEGIES:
+            raise GrammarException(f"Unknown GNF conversion strategy {strategy}")
+        super().__init__(grammar, start_symbol, record_timeline, hooks)
+
+        self.strategy = strategy
+        # processes converting the components, 0 for one per CPU, None to not split
+        self.workers = workers
+        # the prefix of the non-terminals added by remove_left_recursion
+        self.fresh_prefix = "RRE_"
         self.mapping: Dict[RuleRefElement, int] = {}
         self.reverse_mapping: Dict[int, RuleRefElement] = {}
 
         self.simplify()
         self.convert()
 
+    @conversion_pass
     def convert(self):
 
-        self.map_non_terminal_to_ordered_symbols()
-        self.sort_rules_gnf()
-        self.remove_left_recursion()
+        if self.strategy == "left_corner":
+            self.left_corner_transform()
+        elif self.workers is not None:
+            self.convert_components()
+        else:
+            self.map_non_terminal_to_ordered_symbols()
+            self.sort_rules_gnf()
         self.make_rhs_first_symbol_terminal()
         self.sort_rules()
         self.simplify()
 
+    @conversion_pass
     def map_non_terminal_to_ordered_symbols(self):
         """
         Assign a value "i" for non-terminals with ascending order
@@ -40,84 +81,342 @@ class GreibachGrammar(SimplifiedGrammar):
                     self.reverse_mapping[cur] = el
                     cur += 1
 
+    @conversion_pass
     def sort_rules_gnf(self):
         """
         Alter the rules so that the non-terminals are in ascending order, such that if a production s of form
         Ai -> Aj x, then i < j
-        """
-        while True:
-            for rule in self.rules:
-                # Check if i > j
-                if (
-                    isinstance(rule.rhs[0], RuleRefElement)
-                    and self.mapping[rule.lhs] > self.mapping[rule.rhs[0]]
-                ):
-                    matched_rules = self[rule.rhs[0]]
 
+        The non-terminals are taken in order: the rules of Ai starting with a lower Aj
+        get the rules of Aj substituted, until none is left, then the direct left
+        recursion of Ai is removed. Every Aj is free of left recursion by the time it
+        is substituted, so no production is lost on the way.
+        """
+        for symbol in sorted(self.mapping, key=self.mapping.__getitem__):
+            index = self.mapping[symbol]
+            pending = deque(self[symbol])
+            while pending:
+                rule = pending.popleft()
+                first = rule.rhs[0]
+                if isinstance(first, RuleRefElement) and self.mapping[first] < index:
+                    self.rules.discard(rule)
                     # substitute Aj using production rules
-                    for matched_rule in matched_rules:
-                        # avoid left recursion
-                        if matched_rule.lhs != matched_rule.rhs[0]:
-                            new_rule = Rule(rule.lhs, matched_rule.rhs + rule.rhs[1:])
-                            self.rules.append(new_rule)
-
-                    self.rules.remove(rule)
-                    break
-            else:
-                break
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
-
-    def remove_left_recursion(self):
-        while True:
-            for rule in self.rules:
-                if isinstance(rule.rhs[0], RuleRefElement) and rule.lhs == rule.rhs[0]:
-                    # Find all recursive rules with same lhs
-                    recursive_rules = [r for r in self[rule.lhs] if r.lhs == r.rhs[0]]
-
-                    new_symbols: List[RuleRefElement] = []
-                    for rec_rule in recursive_rules:
-                        new_non_terminal = RuleRefElement(
-                            f"RRE_{len(self.non_terminals)}"
-                        )
-                        self.non_terminals.add(new_non_terminal)
-                        self.mapping[new_non_terminal] = len(self.mapping)
-                        self.reverse_mapping[len(self.reverse_mapping)] = (
-                            new_non_terminal
-                        )
-                        new_symbols.append(new_non_terminal)
-                        self.rules.append(Rule(new_non_terminal, rec_rule.rhs[1:]))
-                        self.rules.append(
-                            Rule(
-                                new_non_terminal, rec_rule.rhs[1:] + [new_non_terminal]
-                            )
-                        )
-
-                    self.rules = [
-                        rule for rule in self.rules if rule not in recursive_rules
-                    ]
-
-                    for sym in new_symbols:
-                        lhs_alternative_rules = self[rule.lhs]
-                        for r in lhs_alternative_rules:
-                            self.rules.append(Rule(rule.lhs, r.rhs + [sym]))
-
-                    break
-            else:
-                break
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+                    for matched_rule in self[first]:
+                        new_rule = Rule(symbol, matched_rule.rhs + rule.rhs[1:])
+                        if self.rules.add(new_rule):
+                            pending.append(new_rule)
+            self.remove_left_recursion(symbol)
+        self.record_pass("sort_rules_gnf")
+
+    def remove_left_recursion(self, symbol: RuleRefElement):
+        """
+        Replace A -> A x1 | ... | A xn | y1 | ... | ym by A -> yi | yi Z with
+        Z -> xi | xi Z, for a new non-terminal Z. A unit production A -> A is dropped.
+        """
+        recursive_rules = [rule for rule in self[symbol] if rule.rhs[0] == symbol]
+        if not recursive_rules:
+            return
+        for rule in recursive_rules:
+            self.rules.discard(rule)
+        tails = [rule.rhs[1:] for rule in recursive_rules if len(rule.rhs) > 1]
+        if not tails:
+            return
+
+        # the grammar may already hold names of this form, e.g. from ChomskyGrammar
+        count = len(self.non_terminals)
+        new_non_terminal = RuleRefElement(f"{self.fresh_prefix}{count}")
+        while new_non_terminal in self.non_terminals:
+            count += 1
+            new_non_terminal = RuleRefElement(f"{self.fresh_prefix}{count}")
+        self.non_terminals.add(new_non_terminal)
+        self._map_symbol(new_non_terminal)
+        for tail in tails:
+            self.rules.add(Rule(new_non_terminal, tail))
+            self.rules.add(Rule(new_non_terminal, tail + (new_non_terminal,)))
+        for rule in self[symbol]:
+            self.rules.add(Rule(symbol, rule.rhs + (new_non_terminal,)))
+
+    @conversion_pass
+    # pylint: disable-next=too-many-locals
+    def convert_components(self):
+        """
+        Convert every strongly connected component of the left-corner graph (A -> B when
+        a rule of A starts with B) in its own job, run in a pool of processes.
+
+        Ordering the components so that each comes before the ones its rules start with
+        is a valid order for sort_rules_gnf: no rule is ever substituted into a rule of
+        another component, so the left recursion of each component is removed seeing
+        only the rules of its members. The first symbols of a component are then
+        replaced by the rules of the components it starts with, once those are
+        converted, so a job waits for those jobs only and independent components are
+        converted at the same time. The results are stitched back in topological order.
+        """
+        non_terminals = sorted(self.non_terminals)
+        ids = {non_terminal: index for index, non_terminal in enumerate(non_terminals)}
+        successors: List[List[int]] = [[] for _ in non_terminals]
+        for rule in self.rules:
+            if rule.rhs[0] in ids:
+                successors[ids[rule.lhs]].append(ids[rule.rhs[0]])
+        # the components a component starts with come before it
+        components = [
+            [non_terminals[member] for member in sorted(members)]
+            for members in strongly_connected_components(successors)
+        ]
+        component_of = {
+            symbol: index
+            for index, members in enumerate(components)
+            for symbol in members
+        }
+        depends_on = [
+            {
+                component_of[rule.rhs[0]]
+                for symbol in members
+                for rule in self[symbol]
+                if rule.rhs[0] in component_of and rule.rhs[0] not in members
+            }
+            for members in components
+        ]
+
+        # the rules of every converted component, and by left-hand side
+        results: Dict[int, List[Rule]] = {}
+        converted: Dict[RuleRefElement, List[Rule]] = {}
+
+        def job(index: int) -> Tuple[List[Rule], List[RuleRefElement], List[Rule], str]:
+            members = components[index]
+            rules = [rule for symbol in members for rule in self[symbol]]
+            corners = {rule.rhs[0] for rule in rules} - set(members)
+            corner_rules = [
+                rule for symbol in sorted(corners) for rule in converted.get(symbol, ())
+            ]
+            return rules, members, corner_rules, f"{self.fresh_prefix}{index}_"
+
+        def done(index: int, rules: List[Rule]):
+            results[index] = rules
+            for rule in rules:
+                converted.setdefault(rule.lhs, []).append(rule)
+
+        workers = self.workers or os.cpu_count() or 1
+        if workers > 1 and len(components) > 1:
+            self._run_component_jobs(workers, depends_on, job, done)
+        else:
+            for index in range(len(components)):
+                done(index, convert_component(*job(index)))
+
+        self.mapping.clear()
+        self.reverse_mapping.clear()
+        new_rules: List[Rule] = []
+        for index in reversed(range(len(components))):
+            for symbol in components[index]:
+                self._map_symbol(symbol)
+            for rule in results[index]:
+                self.non_terminals.add(rule.lhs)
+                self._map_symbol(rule.lhs)
+            new_rules.extend(results[index])
+        self.rules = new_rules
+        self.record_pass("convert_components")
+
+    @staticmethod
+    # pylint: disable-next=too-many-locals
+    def _run_component_jobs(
+        workers: int,
+        depends_on: List[Set[int]],
+        job: Callable[[int], tuple],
+        done: Callable[[int, List[Rule]], None],
+    ):
+        """
+        Run convert_component on every component in a process pool, each as soon as the
+        components it depends on are done
+        """
+        dependents: List[List[int]] = [[] for _ in depends_on]
+        waiting = [len(dependencies) for dependencies in depends_on]
+        for index, dependencies in enumerate(depends_on):
+            for dependency in dependencies:
+                dependents[dependency].append(index)
+
+        with ProcessPoolExecutor(workers) as pool:
+            running: Dict[Future, int] = {}
+
+            def submit(index: int):
+                running[pool.submit(convert_component, *job(index))] = index
+
+            for index, count in enumerate(waiting):
+                if count == 0:
+                    submit(index)
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    done(index, future.result())
+                    for dependent in dependents[index]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            submit(dependent)
 
+    def _map_symbol(self, symbol: RuleRefElement):
+        if symbol not in self.mapping:
+            self.reverse_mapping[len(self.mapping)] = symbol
+            self.mapping[symbol] = len(self.mapping)
+
+    @conversion_pass
     def make_rhs_first_symbol_terminal(self):
-        while True:
-            for rule in self.rules:
-                if isinstance(rule.rhs[0], RuleRefElement):
-                    cur_rules = self[rule.rhs[0]]
-                    for cur_rule in cur_rules:
-                        self.rules.append(Rule(rule.lhs, cur_rule.rhs + rule.rhs[1:]))
-                    self.rules.remove(rule)
-                    break
-            else:
-                break
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+        worklist = RuleWorklist(self.rules)
+        for key, rule in worklist:
+            if isinstance(rule.rhs[0], RuleRefElement):
+                for _, cur_rule in worklist[rule.rhs[0]]:
+                    worklist.append(Rule(rule.lhs, cur_rule.rhs + rule.rhs[1:]))
+                worklist.discard(key)
+        self.record_pass("make_rhs_first_symbol_terminal")
+
+    @conversion_pass
+    def left_corner_transform(self):
+        """
+        Rewrite every non-terminal A as A -> a A/a for each terminal a that can start A.
+        A/X derives what may follow X on the left spine of A:
+        A/X -> y A/C and, when C is A, A/X -> y, for every C -> X y with C a left
+        corner of A. A production C -> a gives the unit A/a -> A/C instead, and
+        A -> a when C is A.
+
+        The grammar is simplified first, so apart from the start symbol there are no
+        empty or unit productions to take care of. No production starts with a new
+        non-terminal, so the result has no left recursion and
+        make_rhs_first_symbol_terminal finishes the conversion.
+        """
+        empty_rules = [
+            rule for rule in self.rules if isinstance(rule.rhs[0], EmptyElement)
+        ]
+        rules = [
+            rule for rule in self.rules if not isinstance(rule.rhs[0], EmptyElement)
+        ]
+
+        by_corner: Dict[Element, List[Rule]] = {}
+        for rule in rules:
+            by_corner.setdefault(rule.rhs[0], []).append(rule)
+
+        left_corners = self._left_corners()
+
+        names: Dict[Tuple[RuleRefElement, Element], RuleRefElement] = {}
+        needed: List[Tuple[RuleRefElement, Element]] = []
+
+        def slash(lhs: RuleRefElement, corner: Element) -> RuleRefElement:
+            key = (lhs, corner)
+            if key not in names:
+                label = corner.value
+                if not isinstance(corner, RuleRefElement):
+                    label = f'"{label}"'
+                names[key] = RuleRefElement(f"{lhs.value}/{label}")
+                self.non_terminals.add(names[key])
+                needed.append(key)
+            return names[key]
+
+        new_rules: List[Rule] = []
+        for lhs, corners in left_corners.items():
+            for corner in corners:
+                if isinstance(corner, RuleRefElement):
+                    continue
+                new_rules.append(Rule(lhs, [corner, slash(lhs, corner)]))
+                if any(
+                    rule.lhs == lhs and len(rule.rhs) == 1 for rule in by_corner[corner]
+                ):
+                    new_rules.append(Rule(lhs, [corner]))
+
+        while needed:
+            lhs, corner = needed.pop()
+            for rule in by_corner.get(corner, []):
+                if rule.lhs not in left_corners[lhs]:
+                    continue
+                rest = rule.rhs[1:]
+                new_rules.append(
+                    Rule(names[lhs, corner], rest + (slash(lhs, rule.lhs),))
+                )
+                if rest and rule.lhs == lhs:
+                    new_rules.append(Rule(names[lhs, corner], rest))
+
+        self.rules = empty_rules + new_rules
+        self.record_pass("left_corner_transform")
+
+    def _left_corners(self) -> Dict[RuleRefElement, Set[Element]]:
+        """
+        For each non-terminal A, A itself and every symbol that can start a derivation of A
+        """
+        left_corners: Dict[RuleRefElement, Set[Element]] = {}
+        for lhs in self.non_terminals:
+            corners: Set[Element] = {lhs}
+            pending = [lhs]
+            while pending:
+                for rule in self[pending.pop()]:
+                    corner = rule.rhs[0]
+                    if corner not in corners and not isinstance(corner, EmptyElement):
+                        corners.add(corner)
+                        if isinstance(corner, RuleRefElement):
+                            pending.append(corner)
+            left_corners[lhs] = corners
+        return left_corners
+
+
+class ComponentGreibachGrammar(GreibachGrammar):
+    """
+    The rules of one strongly connected component of the left-corner graph converted
+    to GNF, given the GNF rules of the non-terminals of other components its rules
+    start with (corner_rules). The non-terminals of other components come after the
+    members in the order, so the substitution passes never touch their rules.
+
+    Removing left recursion adds tails made of what follows the recursive symbol, and
+    a tail may start with a non-terminal of another component that is not a corner:
+    its rules are not here, and that component may even depend on this one. Such
+    tails are returned as they are, for the make_rhs_first_symbol_terminal pass of the
+    whole grammar, which runs once every component is converted.
+    """
+
+    # pylint: disable-next=super-init-not-called
+    def __init__(
+        self,
+        rules: List[Rule],
+        members: List[RuleRefElement],
+        corner_rules: List[Rule],
+        fresh_prefix: str,
+    ):
+        # only the passes are shared, the grammar is neither simplified nor converted
+        # pylint: disable-next=non-parent-init-called
+        SimplifiedGrammar.__init__(self, GeneralGrammar({}), members[0], False)
+        self.rules = rules
+        self.detect_symbols()
+        self.strategy = "substitution"
+        self.workers = None
+        self.fresh_prefix = fresh_prefix
+        self.mapping = {}
+        self.reverse_mapping = {}
+        for symbol in members:
+            self._map_symbol(symbol)
+        for rule in rules:
+            for el in sorted(rule.get_all_element()):
+                if isinstance(el, RuleRefElement):
+                    self._map_symbol(el)
+
+        if any(rule.rhs[0] in members for rule in rules):
+            self.sort_rules_gnf()
+        corners = {rule.lhs for rule in corner_rules}
+        own = set(members) | corners | {rule.lhs for rule in self.rules}
+        tails = [
+            rule
+            for rule in self.rules
+            if isinstance(rule.rhs[0], RuleRefElement) and rule.rhs[0] not in own
+        ]
+        for rule in tails:
+            self.rules.discard(rule)
+        self.rules.extend(corner_rules)
+        self.make_rhs_first_symbol_terminal()
+        self.rules = [rule for rule in self.rules if rule.lhs not in corners] + tails
+
+
+def convert_component(
+    rules: List[Rule],
+    members: List[RuleRefElement],
+    corner_rules: List[Rule],
+    fresh_prefix: str,
+) -> List[Rule]:
+    """
+    The GNF rules of a component, run in the process pool of
+    GreibachGrammar.convert_components
+    """
+    grammar = ComponentGreibachGrammar(rules, members, corner_rules, fresh_prefix)
+    return list(grammar.rules)
@@ -1,23 +1,46 @@
-from typing import List, Set, Union
+from typing import Iterable, List, Set, Union
 
 from piu.grammars.element import RuleRefElement, TerminalElement
 from piu.grammars.converters.type import GeneralGrammar
-from piu.grammars.converters.rule import Rule
+from piu.grammars.converters.rule import Rule, RuleSet
 
 
 class Grammar:
     def __init__(
         self, grammar: Union[str, GeneralGrammar], start_symbol: RuleRefElement
     ):
-        self.rules: List[Rule] = []
+        self._rules: RuleSet = RuleSet()
         self.build_rules(grammar)
         self.start_symbol = start_symbol
         self.terminals: Set[TerminalElement] = set()
         self.non_terminals: Set[RuleRefElement] = set()
         self.detect_symbols()
 
+    @property
+    def rules(self) -> RuleSet:
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules: Iterable[Rule]):
+        """
+        Replace the rules. An observer of the old rules moves to the new ones and is told
+        about the difference, which costs as much as building the new rules; passes
+        editing a few rules do it in place instead.
+        """
+        rule_set = rules if isinstance(rules, RuleSet) else RuleSet(rules)
+        observer = self._rules.observer
+        if observer is not None and rule_set is not self._rules:
+            for rule in self._rules:
+                if rule not in rule_set:
+                    observer.rule_removed(rule)
+            for rule in rule_set:
+                if rule not in self._rules:
+                    observer.rule_added(rule)
+            rule_set.observer = observer
+        self._rules = rule_set
+
     def __getitem__(self, lhs: RuleRefElement) -> List[Rule]:
-        return [r for r in self.rules if r.lhs == lhs]
+        return self.rules.by_lhs(lhs)
 
     def build_rules(self, grammar: GeneralGrammar):
         self.split_rules(grammar)
@@ -37,7 +60,7 @@ class Grammar:
         for lhs, rhs in grammar.items():
             if len(rhs) > 1:
                 for seq in rhs[1:]:
-                    self.rules.append(Rule(lhs, seq))
+                    self.rules.add(Rule(lhs, seq))
 
     def detect_symbols(self):
         for rule in self.rules:
@@ -57,10 +80,12 @@ class Grammar:
             else:
                 grammar[rule.lhs].add(rule.rhs)
 
-        result = {k: sorted(list(v)) for k, v in grammar.items()}
+        result = {k: [list(rhs) for rhs in sorted(v)] for k, v in grammar.items()}
         return result
 
     def sort(self):
         s_productions = self[self.start_symbol]
-        other_productions = [rule for rule in self.rules if rule not in s_productions]
+        other_productions = [
+            rule for rule in self.rules if rule.lhs != self.start_symbol
+        ]
         self.rules = s_productions + other_productions
@@ -0,0 +1,212 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+PassMethod = TypeVar("PassMethod", bound=Callable)
+
+
+class PassEvent(NamedTuple):
+    """
+    A conversion pass starting ("before") or finishing ("after").
+    The deltas and seconds are 0 before the pass; traced_bytes is None unless
+    tracemalloc is tracing.
+    """
+
+    grammar: str
+    name: str
+    phase: str
+    depth: int
+    start: float
+    seconds: float
+    rules: int
+    non_terminals: int
+    rules_delta: int
+    non_terminals_delta: int
+    blocks_delta: int
+    traced_bytes_delta: Optional[int]
+
+
+class ConversionHook:
+    """
+    Receives an event before and after every pass of SimplifiedGrammar and its subclasses.
+    Passes run inside other passes (simplify, convert), so events nest by depth.
+    """
+
+    def before_pass(self, event: PassEvent):
+        pass
+
+    def after_pass(self, event: PassEvent):
+        pass
+
+
+# hooks for every grammar, including the ones built inside the library
+PASS_HOOKS: List[ConversionHook] = []
+
+
+def register_hook(hook: ConversionHook):
+    PASS_HOOKS.append(hook)
+
+
+def unregister_hook(hook: ConversionHook):
+    PASS_HOOKS.remove(hook)
+
+
+# rules, non-terminals, allocated blocks and traced bytes
+Counters = Tuple[int, int, int, Optional[int]]
+
+
+def _counters(grammar) -> Counters:
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    return (
+        len(grammar.rules),
+        len(grammar.non_terminals),
+        sys.getallocatedblocks(),
+        traced,
+    )
+
+
+def _pass_event(
+    grammar,
+    name: str,
+    start: float,
+    seconds: float = 0.0,
+    since: Optional[Counters] = None,
+) -> PassEvent:
+    """
+    The event before a pass, or after it when given the counters from before
+    """
+    rules, non_terminals, blocks, traced = _counters(grammar)
+    if since is None:
+        deltas: Counters = (0, 0, 0, None)
+    else:
+        deltas = (
+            rules - since[0],
+            non_terminals - since[1],
+            blocks - since[2],
+            None if traced is None or since[3] is None else traced - since[3],
+        )
+    return PassEvent(
+        type(grammar).__name__,
+        name,
+        "before" if since is None else "after",
+        grammar.pass_depth,
+        start,
+        seconds,
+        rules,
+        non_terminals,
+        *deltas,
+    )
+
+
+def conversion_pass(method: PassMethod) -> PassMethod:
+    """
+    Mark a grammar method as a pass reported to the hooks. Without a hook the pass runs
+    directly, after a single check.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def run_pass(self, *args, **kwargs):
+        hooks = self.hooks + PASS_HOOKS if PASS_HOOKS else self.hooks
+        if not hooks:
+            return method(self, *args, **kwargs)
+
+        before = _pass_event(self, name, time.perf_counter())
+        for hook in hooks:
+            hook.before_pass(before)
+
+        since = _counters(self)
+        start = time.perf_counter()
+        self.pass_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.pass_depth -= 1
+            seconds = time.perf_counter() - start
+            after = _pass_event(self, name, start, seconds, since)
+            for hook in hooks:
+                hook.after_pass(after)
+
+    return run_pass  # type: ignore[return-value]
+
+
+class PassSummary(ConversionHook):
+    """
+    Totals per grammar class and pass, printed as a table by str()
+    """
+
+    COLUMNS = ("calls", "seconds", "rules_delta", "non_terminals_delta", "blocks_delta")
+
+    def __init__(self):
+        self.totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.depths: Dict[Tuple[str, str], int] = {}
+
+    def before_pass(self, event: PassEvent):
+        # rows in the order the passes start, so enclosing passes come first
+        key = (event.grammar, event.name)
+        self.totals.setdefault(key, dict.fromkeys(self.COLUMNS, 0))
+        self.depths.setdefault(key, event.depth)
+
+    def after_pass(self, event: PassEvent):
+        totals = self.totals[event.grammar, event.name]
+        totals["calls"] += 1
+        totals["seconds"] += event.seconds
+        totals["rules_delta"] += event.rules_delta
+        totals["non_terminals_delta"] += event.non_terminals_delta
+        totals["blocks_delta"] += event.blocks_delta
+
+    def __str__(self) -> str:
+        lines = [
+            f"{'pass':<56} {'calls':>6} {'ms':>10} {'rules':>8} {'symbols':>8} {'blocks':>9}"
+        ]
+        for (grammar, name), totals in self.totals.items():
+            label = "  " * self.depths[grammar, name] + f"{grammar}.{name}"
+            lines.append(
+                f"{label:<56} {totals['calls']:>6} {totals['seconds'] * 1000:>10.2f} "
+                f"{totals['rules_delta']:>+8} {totals['non_terminals_delta']:>+8} "
+                f"{totals['blocks_delta']:>+9}"
+            )
+        return "\n".join(lines)
+
+
+class ChromeTrace(ConversionHook):
+    """
+    Every pass as a complete event of the Chrome trace event format,
+    to open in chrome://tracing or Perfetto
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events: List[dict] = []
+
+    def after_pass(self, event: PassEvent):
+        self.events.append(
+            {
+                "name": event.name,
+                "cat": event.grammar,
+                "ph": "X",
+                "ts": (event.start - self.origin) * 1e6,
+                "dur": event.seconds * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {
+                    field: getattr(event, field)
+                    for field in PassEvent._fields[6:]
+                    if getattr(event, field) is not None
+                },
+            }
+        )
+
+    def export(self) -> dict:
+        # events are appended as passes finish, the viewer wants them by start
+        events = sorted(self.events, key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.export(), file)
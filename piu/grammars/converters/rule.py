@@ -1,22 +1,26 @@
-from typing import List, Set, Union
+from collections import deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from piu.grammars.element import Element, RuleRefElement
 
 
-class ElementList(list):
-    def __init__(self, l: Union[List[Element], "ElementList"]):
-        super().__init__(l)
+class Rule:
+    """
+    A production lhs -> rhs. Rules are immutable: the right-hand side is a tuple and the
+    hash is computed once, so rules can be stored in sets and dict keys.
+    """
 
-    def __hash__(self) -> int:
-        return hash(tuple(self))
+    __slots__ = ("lhs", "rhs", "_hash")
 
+    def __init__(self, lhs: RuleRefElement, rhs: Iterable[Element]):
+        object.__setattr__(self, "lhs", lhs)
+        object.__setattr__(self, "rhs", tuple(rhs))
+        object.__setattr__(self, "_hash", hash((lhs, self.rhs)))
 
-class Rule:
-    def __init__(self, lhs: RuleRefElement, rhs: Union[List[Element], ElementList]):
-        self.lhs = lhs
-        self.rhs = ElementList(rhs)
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Rule is immutable, cannot set {name}")
 
     def get_all_element(self) -> Set[Element]:
-        return set([self.lhs] + self.rhs)
+        return {self.lhs, *self.rhs}
 
     def is_unit_production(self) -> bool:
         return len(self.rhs) == 1 and isinstance(self.rhs[0], RuleRefElement)
@@ -28,4 +32,158 @@ class Rule:
         return self.__str__()
 
     def __eq__(self, other: "Rule") -> bool:
-        return self.lhs == other.lhs and self.rhs == other.rhs
+        if self is other:
+            return True
+        if not isinstance(other, Rule):
+            return NotImplemented
+        # elements are interned, so the lhs compares by identity
+        return (
+            self._hash == other._hash
+            and self.lhs is other.lhs
+            and self.rhs == other.rhs
+        )
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self):
+        return self.__class__, (self.lhs, self.rhs)
+
+
+class RuleObserver:
+    """
+    Told about every rule added to or removed from the RuleSet it observes
+    """
+
+    def rule_added(self, rule: Rule):
+        pass
+
+    def rule_removed(self, rule: Rule):
+        pass
+
+
+class RuleSet:
+    """
+    The rules of a grammar in insertion order, without duplicates, with an index from
+    every left-hand side to its rules. Adding, removing and testing a rule are O(1), and
+    looking up the rules of a non-terminal costs O(1) plus the number of rules returned.
+    The observer, if any, is told about every rule actually added or removed.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = ()):
+        self._rules: Dict[Rule, None] = {}
+        self.lhs_index: Dict[RuleRefElement, Dict[Rule, None]] = {}
+        self.observer: Optional[RuleObserver] = None
+        self.extend(rules)
+
+    def by_lhs(self, lhs: RuleRefElement) -> List[Rule]:
+        return list(self.lhs_index.get(lhs, ()))
+
+    def add(self, rule: Rule) -> bool:
+        """
+        Add the rule unless it is already there, returning whether it was added
+        """
+        if rule in self._rules:
+            return False
+        self._rules[rule] = None
+        self.lhs_index.setdefault(rule.lhs, {})[rule] = None
+        if self.observer is not None:
+            self.observer.rule_added(rule)
+        return True
+
+    def extend(self, rules: Iterable[Rule]):
+        for rule in rules:
+            self.add(rule)
+
+    def discard(self, rule: Rule):
+        if rule not in self._rules:
+            return
+        del self._rules[rule]
+        same_lhs = self.lhs_index[rule.lhs]
+        del same_lhs[rule]
+        if not same_lhs:
+            del self.lhs_index[rule.lhs]
+        if self.observer is not None:
+            self.observer.rule_removed(rule)
+
+    def remove(self, rule: Rule):
+        if rule not in self._rules:
+            raise KeyError(rule)
+        self.discard(rule)
+
+    def clear(self):
+        if self.observer is not None:
+            for rule in self._rules:
+                self.observer.rule_removed(rule)
+        self._rules = {}
+        self.lhs_index = {}
+
+    def __contains__(self, rule: Rule) -> bool:
+        return rule in self._rules
+
+    def __iter__(self) -> Iterator[Rule]:
+        return iter(self._rules)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def __repr__(self) -> str:
+        return f"RuleSet({list(self._rules)!r})"
+
+    def __reduce__(self):
+        return self.__class__, (list(self._rules),)
+
+
+class RuleWorklist:
+    """
+    Rules in insertion order with O(1) append and removal, consumed as a FIFO worklist.
+    Iterating yields every live rule exactly once, including rules appended during the
+    iteration, so a pass visits each rule a bounded number of times instead of
+    restarting its scan after every rewrite. Appending a rule that is already live
+    returns its key without queueing it again.
+
+    A worklist built on a RuleSet edits it in place: appends and discards are applied
+    to the set too, so the set ends up with the live rules in the same order.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = ()):
+        self._rule_set = rules if isinstance(rules, RuleSet) else None
+        self._alive: Dict[int, Rule] = {}
+        self._keys: Dict[Rule, int] = {}
+        self._lhs_index: Dict[RuleRefElement, Dict[int, Rule]] = {}
+        self._queue: Deque[int] = deque()
+        self._next_key = 0
+        for rule in rules:
+            self.append(rule)
+
+    def append(self, rule: Rule) -> int:
+        if rule in self._keys:
+            return self._keys[rule]
+        key = self._next_key
+        self._next_key += 1
+        self._alive[key] = rule
+        self._keys[rule] = key
+        self._lhs_index.setdefault(rule.lhs, {})[key] = rule
+        self._queue.append(key)
+        if self._rule_set is not None:
+            self._rule_set.add(rule)
+        return key
+
+    def discard(self, key: int):
+        rule = self._alive.pop(key)
+        del self._keys[rule]
+        del self._lhs_index[rule.lhs][key]
+        if self._rule_set is not None:
+            self._rule_set.discard(rule)
+
+    def __getitem__(self, lhs: RuleRefElement) -> List[Tuple[int, Rule]]:
+        return list(self._lhs_index.get(lhs, {}).items())
+
+    def __iter__(self) -> Iterator[Tuple[int, Rule]]:
+        while self._queue:
+            key = self._queue.popleft()
+            if key in self._alive:
+                yield key, self._alive[key]
+
+    def rules(self) -> List[Rule]:
+        return list(self._alive.values())
@@ -1,27 +1,48 @@
-import copy
-from typing import List, Tuple
-import itertools
-import inspect
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
 
 from piu.grammars.converters.grammar import Grammar
-from piu.grammars.converters.rule import Rule
+from piu.grammars.converters.hooks import ConversionHook, conversion_pass
+from piu.grammars.converters.rule import Rule, RuleSet
+from piu.grammars.converters.timeline import ConversionTimeline
 from piu.grammars.converters.type import GeneralGrammar
-from piu.grammars.element import RuleRefElement, EmptyElement
-from piu.grammars.converters.utils import DEBUG
+from piu.grammars.element import Element, RuleRefElement, EmptyElement
+from piu.grammars.converters.utils import (
+    DEBUG,
+    derive_bottom_up,
+    strongly_connected_components,
+)
 
 
 class AlterStartElement(RuleRefElement):
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("S'")
 
 
 class SimplifiedGrammar(Grammar):
 
-    def __init__(self, grammar: GeneralGrammar, start_symbol: RuleRefElement):
+    def __init__(
+        self,
+        grammar: GeneralGrammar,
+        start_symbol: RuleRefElement,
+        record_timeline: bool = DEBUG,
+        hooks: Sequence[ConversionHook] = (),
+    ):
         super().__init__(grammar, start_symbol)
-        self.grammar_timeline: List[Tuple[str, Grammar]] = []
-
+        # told before and after every pass, along with the registered PASS_HOOKS
+        self.hooks: List[ConversionHook] = list(hooks)
+        self.pass_depth = 0
+        # the rules each pass added and removed, when record_timeline is on
+        self.grammar_timeline = ConversionTimeline()
+        if record_timeline:
+            self.grammar_timeline.start(self)
+
+    def record_pass(self, name: str):
+        self.grammar_timeline.record(name, self)
+
+    @conversion_pass
     def simplify(self):
         self.add_new_start_symbol()
         self.remove_redundant_non_terminals()
@@ -30,18 +51,16 @@ class SimplifiedGrammar(Grammar):
         self.remove_unit_productions()
         self.sort_rules()
 
+    @conversion_pass
     def add_new_start_symbol(self):
         if self.check_start_symbol_is_used():
             new_start_symbol = AlterStartElement()
             new_rule = Rule(new_start_symbol, [self.start_symbol])
-            self.rules.insert(0, new_rule)
+            self.rules = [new_rule, *self.rules]
             self.non_terminals.add(new_start_symbol)
             self.start_symbol = new_start_symbol
 
-            if DEBUG:
-                self.grammar_timeline.append(
-                    (inspect.stack()[0][3], copy.deepcopy(self))
-                )
+            self.record_pass("add_new_start_symbol")
 
     def check_start_symbol_is_used(self):
         for rule in self.rules:
@@ -49,122 +68,133 @@ class SimplifiedGrammar(Grammar):
                 return True
         return False
 
+    @conversion_pass
     def remove_redundant_non_terminals(self):
         """
         Ｆind non-terminals that don't generate a terminal and remove rules containing them
         """
-        prev_set = set()
-        current_set = self.terminals.copy()
-        while prev_set != current_set:
-            prev_set = current_set.copy()
-            for rule in self.rules:
-                # check if current rule derives any of current_set symbols
-                rhs_current_set_intersection = [
-                    symbol for symbol in rule.rhs if symbol in current_set
-                ]
-                if len(rhs_current_set_intersection) == len(rule.rhs):
-                    current_set.add(rule.lhs)
-
-        redundant_symbols = self.non_terminals.difference(current_set)
+        generating = self.derive_bottom_up(
+            lambda rule: [el for el in rule.rhs if el not in self.terminals]
+        )
+        redundant_symbols = self.non_terminals.difference(generating)
 
         # Remove Rules which consist of redundant symbols
         if redundant_symbols:
-            self.rules = [
+            for rule in [
                 rule
                 for rule in self.rules
-                if not rule.get_all_element().intersection(redundant_symbols)
-            ]
+                if rule.get_all_element().intersection(redundant_symbols)
+            ]:
+                self.rules.discard(rule)
             self.non_terminals = self.non_terminals.difference(redundant_symbols)
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+        self.record_pass("remove_redundant_non_terminals")
 
+    @conversion_pass
     def remove_unreachable_symbols(self):
         """
         Find symbols that are unreachable from starting symbol and remove rules containing them
         """
-        prev_set = set()
-        current_set = {self.start_symbol}
-        while prev_set != current_set:
-            prev_set = current_set.copy()
-            for rule in self.rules:
-                if rule.lhs in current_set:
-                    current_set.update(rule.get_all_element())
+        reachable = {self.start_symbol}
+        pending = [self.start_symbol]
+        while pending:
+            for rule in self[pending.pop()]:
+                for el in rule.rhs:
+                    if el not in reachable:
+                        reachable.add(el)
+                        if isinstance(el, RuleRefElement):
+                            pending.append(el)
 
         unreachable_symbols = self.terminals.union(self.non_terminals).difference(
-            current_set
+            reachable
         )
         if unreachable_symbols:
-            self.rules = [
+            for rule in [
                 rule
                 for rule in self.rules
-                if not rule.get_all_element().intersection(unreachable_symbols)
-            ]
+                if rule.get_all_element().intersection(unreachable_symbols)
+            ]:
+                self.rules.discard(rule)
 
             self.non_terminals = self.non_terminals.difference(unreachable_symbols)
 
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+        self.record_pass("remove_unreachable_symbols")
 
+    @conversion_pass
     def remove_null_productions(self):
         """
         Null production:
         A -> ε or A -> ... -> ε
 
-        1- Look for all productions whose right-side contains A
-        2- Replace each occurrences of A in these productions with ε
-        3- Add the result productions to the grammar
-        """
-        nullable_non_terminals: List[RuleRefElement] = []
-        while True:
-            for rule in self.rules:
-                if (
-                    rule.lhs != self.start_symbol
-                    and len(rule.rhs) == 1
-                    and isinstance(rule.rhs[0], EmptyElement)
-                ):
-                    nullable_non_terminals.append(rule.lhs)
-                    self.rules.remove(rule)
-                    break
-                else:
-                    current_rhs_non_terminal = [
-                        el for el in rule.rhs if isinstance(el, RuleRefElement)
-                    ]
-                    if (
-                        rule.lhs not in nullable_non_terminals
-                        and len(rule.rhs) == len(current_rhs_non_terminal)
-                        and all(
-                            t in nullable_non_terminals
-                            for t in current_rhs_non_terminal
-                        )
-                    ):
-                        nullable_non_terminals.append(rule.lhs)
-                        break
-            else:
-                break
-
-        for nullable_non_t in nullable_non_terminals:
-            if nullable_non_t != self.start_symbol:
-                self.add_new_rules_by_replacing_nullable_symbol(nullable_non_t)
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
-
-    def add_new_rules_by_replacing_nullable_symbol(
-        self, nullable_symbol: RuleRefElement
-    ):
+        1- Find the nullable non-terminals
+        2- Replace each rule with every variant of it that leaves out some of the
+           nullable occurrences in its right side, except the empty one
+        3- Drop the ε rules and empty right sides, apart from those of the start symbol
+
+        Each distinct rule is added once: a rule with k nullable occurrences has at most
+        2^k variants whatever the number of distinct nullable symbols in it.
+        """
+        nullable = self.find_nullable_non_terminals()
+        nullable.discard(self.start_symbol)
+
+        new_rules = RuleSet()
         for rule in self.rules:
-            occ_indices = [
-                index for index, sym in enumerate(rule.rhs) if sym == nullable_symbol
-            ]
-            # for all combinations of occurrence indices add a new rule
-            combinations = []
-            for i in range(1, len(occ_indices) + 1):
-                combinations += list(itertools.combinations(occ_indices, i))
-
-            for comb in combinations:
-                new_rhs = [el for ind, el in enumerate(rule.rhs) if ind not in comb]
-                if new_rhs:
-                    self.rules.append(Rule(rule.lhs, new_rhs))
+            if rule.lhs != self.start_symbol and self.is_null_production(rule):
+                continue
+            for rhs in self.drop_nullable_symbols(rule.rhs, nullable):
+                new_rules.add(Rule(rule.lhs, rhs))
+        self.rules = new_rules
+        self.record_pass("remove_null_productions")
+
+    @staticmethod
+    def is_null_production(rule: Rule) -> bool:
+        # Lark exports an empty alternative as an empty right side
+        return not rule.rhs or (
+            len(rule.rhs) == 1 and isinstance(rule.rhs[0], EmptyElement)
+        )
 
+    def find_nullable_non_terminals(self) -> Set[RuleRefElement]:
+        """
+        Non-terminals deriving ε
+        """
+        return self.derive_bottom_up(self._nullable_waiting_on)
+
+    def _nullable_waiting_on(self, rule: Rule) -> Optional[Sequence[Element]]:
+        if self.is_null_production(rule):
+            return []
+        if all(isinstance(el, RuleRefElement) for el in rule.rhs):
+            return rule.rhs
+        # a terminal never derives ε
+        return None
+
+    def derive_bottom_up(
+        self, waiting_on: Callable[[Rule], Optional[Sequence[Element]]]
+    ) -> Set[RuleRefElement]:
+        """
+        The least set of non-terminals having a rule whose awaited symbols are all in the
+        set, where waiting_on gives the symbols a rule awaits or None if it never fires
+        (see utils.derive_bottom_up)
+        """
+        return derive_bottom_up((rule.lhs, waiting_on(rule)) for rule in self.rules)
+
+    @staticmethod
+    def drop_nullable_symbols(
+        rhs: Tuple[Element, ...], nullable: Set[RuleRefElement]
+    ) -> List[Tuple[Element, ...]]:
+        """
+        The distinct non-empty right sides obtained by leaving out any subset of the
+        nullable occurrences, the full right side first
+        """
+        variants: Dict[Tuple[Element, ...], None] = {(): None}
+        for el in rhs:
+            extended: Dict[Tuple[Element, ...], None] = {}
+            for variant in variants:
+                extended[variant + (el,)] = None
+                if el in nullable:
+                    extended[variant] = None
+            variants = extended
+        return [variant for variant in variants if variant]
+
+    @conversion_pass
     def remove_unit_productions(self):
         """
         Unit production:
@@ -173,35 +203,53 @@ class SimplifiedGrammar(Grammar):
         1- Add A -> x to grammar whenever B -> x occurs
         2- Delete A -> B from grammar
         """
-        current = {}.fromkeys(self.non_terminals)
-        current = {key: {key} for key in current}
-        prev = {}
-        while current != prev:
-            prev = copy.deepcopy(current)
-            for rule in self.rules:
-                if rule.is_unit_production():
-                    for _, unit_set in current.items():
-                        if rule.lhs in unit_set:
-                            unit_set.add(rule.rhs[0])
-
-        new_rules = []
-        for non_terminal_a, unit_set in current.items():
-            for non_terminal_b in unit_set:
-                b_rules = self[non_terminal_b]
-                for rule in b_rules:
-                    if not rule.is_unit_production():
-                        new_rule = Rule(non_terminal_a, rule.rhs)
-                        new_rules.append(new_rule)
-
-        self.rules = [rule for rule in self.rules if not rule.is_unit_production()]
-
-        for rule in new_rules:
-            if rule not in self.rules:
-                self.rules.append(rule)
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
-
+        # sorted, so the order of the new rules does not depend on set iteration
+        non_terminals = sorted(self.non_terminals)
+        unit_closure = self.unit_closure(non_terminals)
+
+        for rule in [rule for rule in self.rules if rule.is_unit_production()]:
+            self.rules.discard(rule)
+        # the rules of each non-terminal before any rule is copied to it
+        own_rules = [self[non_terminal] for non_terminal in non_terminals]
+        for index, non_terminal_a in enumerate(non_terminals):
+            # set bits in ascending order, the order of non_terminals
+            bits = unit_closure[index] & ~(1 << index)
+            while bits:
+                low = bits & -bits
+                bits ^= low
+                for rule in own_rules[low.bit_length() - 1]:
+                    self.rules.add(Rule(non_terminal_a, rule.rhs))
+        self.record_pass("remove_unit_productions")
+
+    def unit_closure(self, non_terminals: List[RuleRefElement]) -> List[int]:
+        """
+        For each non-terminal, the bitset over non_terminals of those it derives through
+        unit productions, itself included.
+        The unit graph is condensed into strongly connected components, which share one
+        closure: the union of their members and of the closures of the components they
+        point to. The components come in reverse topological order, so those closures
+        are complete by the time they are needed.
+        """
+        ids = {non_terminal: index for index, non_terminal in enumerate(non_terminals)}
+        successors: List[List[int]] = [[] for _ in non_terminals]
+        for rule in self.rules:
+            if rule.is_unit_production() and rule.lhs in ids and rule.rhs[0] in ids:
+                successors[ids[rule.lhs]].append(ids[rule.rhs[0]])
+
+        closure = [0] * len(non_terminals)
+        for members in strongly_connected_components(successors):
+            bits = 0
+            for member in members:
+                bits |= 1 << member
+            for member in members:
+                for successor in successors[member]:
+                    # successors outside the component are already closed
+                    bits |= closure[successor]
+            for member in members:
+                closure[member] = bits
+        return closure
+
+    @conversion_pass
     def sort_rules(self):
         self.sort()
-        if DEBUG:
-            self.grammar_timeline.append((inspect.stack()[0][3], copy.deepcopy(self)))
+        self.record_pass("sort_rules")
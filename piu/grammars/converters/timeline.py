@@ -0,0 +1,105 @@
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from piu.grammars.converters.grammar import Grammar
+from piu.grammars.converters.rule import Rule, RuleObserver
+from piu.grammars.converters.type import GeneralGrammar
+from piu.grammars.element import Element, RuleRefElement
+
+
+class TimelineEntry(NamedTuple):
+    name: str
+    start_symbol: RuleRefElement
+    added: List[Rule]
+    removed: List[Rule]
+
+
+class ConversionTimeline(RuleObserver):
+    """
+    A log of the rules every conversion pass added and removed, from which the grammar
+    after any pass is rebuilt on demand.
+
+    Rules are immutable and shared with the grammar, so the log grows with the number
+    of changes rather than with the grammar size times the number of passes. The
+    timeline observes the rules of the grammar (see RuleSet.observer) and collects the
+    changes as they are made; recording a pass only closes the changes collected since
+    the previous one.
+
+    Iterating yields (pass name, grammar after the pass) like the list of deep copies
+    it replaces.
+    """
+
+    def __init__(self):
+        self.initial: List[Rule] = []
+        self.entries: List[TimelineEntry] = []
+        self.recording = False
+        # the changes since the last recorded pass, a rule being in at most one of them
+        self._added: Dict[Rule, None] = {}
+        self._removed: Dict[Rule, None] = {}
+
+    def start(self, grammar: Grammar):
+        """
+        Start recording, the rules of the grammar being the initial state
+        """
+        self.initial = list(grammar.rules)
+        self.entries = []
+        self._added = {}
+        self._removed = {}
+        self.recording = True
+        grammar.rules.observer = self
+
+    def rule_added(self, rule: Rule):
+        if rule in self._removed:
+            del self._removed[rule]
+        else:
+            self._added[rule] = None
+
+    def rule_removed(self, rule: Rule):
+        if rule in self._added:
+            del self._added[rule]
+        else:
+            self._removed[rule] = None
+
+    def record(self, name: str, grammar: Grammar):
+        if not self.recording:
+            return
+        self.entries.append(
+            TimelineEntry(
+                name, grammar.start_symbol, list(self._added), list(self._removed)
+            )
+        )
+        self._added = {}
+        self._removed = {}
+
+    def _replay(self) -> Iterator[Tuple[TimelineEntry, Dict[Rule, None]]]:
+        rules = dict.fromkeys(self.initial)
+        for entry in self.entries:
+            for rule in entry.removed:
+                del rules[rule]
+            rules.update(dict.fromkeys(entry.added))
+            yield entry, rules
+
+    @staticmethod
+    def _build(rules: Dict[Rule, None], start_symbol: RuleRefElement) -> Grammar:
+        grammar: Dict[RuleRefElement, List[List[Element]]] = {}
+        for rule in rules:
+            grammar.setdefault(rule.lhs, []).append(list(rule.rhs))
+        return Grammar(GeneralGrammar(grammar), start_symbol)
+
+    def rebuild(self, index: int) -> Grammar:
+        """
+        The grammar after the pass of entries[index], replaying the log from the start
+        """
+        # negative indices count from the end, others out of range raise IndexError
+        index = range(len(self.entries))[index]
+        for position, (entry, rules) in enumerate(self._replay()):
+            if position == index:
+                return self._build(rules, entry.start_symbol)
+        raise IndexError(index)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Tuple[str, Grammar]]:
+        # a single replay for the whole walk
+        for entry, rules in self._replay():
+            yield entry.name, self._build(rules, entry.start_symbol)
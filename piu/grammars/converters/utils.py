@@ -1,8 +1,21 @@
-from piu.grammars.converters.type import GeneralGrammar
+from typing import (
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
+from piu.grammars.converters.type import GeneralGrammar
 
 DEBUG = False
 
+Symbol = TypeVar("Symbol", bound=Hashable)
+
 
 def print_grammar(grammar: GeneralGrammar):
     for lhs, rhs in grammar.items():
@@ -11,3 +24,93 @@ def print_grammar(grammar: GeneralGrammar):
             + "->"
             + " |".join(["".join([str(el) for el in seq]) for seq in rhs])
         )
+
+
+def derive_bottom_up(
+    rules: Iterable[Tuple[Symbol, Optional[Sequence[Symbol]]]],
+) -> Set[Symbol]:
+    """
+    The least set of symbols having a rule whose awaited symbols are all in the set,
+    each rule being its left side and the symbols it awaits, or None if it never fires.
+    Every rule counts the occurrences it still awaits and a symbol joining the set
+    decrements the rules it occurs in, so the time is linear in the grammar size.
+    """
+    lhs: List[Symbol] = []
+    remaining: List[int] = []
+    occurrences: Dict[Symbol, List[int]] = {}
+    pending: List[Symbol] = []
+    for index, (symbol, awaited) in enumerate(rules):
+        lhs.append(symbol)
+        if awaited is None:
+            remaining.append(-1)
+            continue
+        remaining.append(len(awaited))
+        for el in awaited:
+            occurrences.setdefault(el, []).append(index)
+        if not awaited:
+            pending.append(symbol)
+
+    derived: Set[Symbol] = set()
+    while pending:
+        symbol = pending.pop()
+        if symbol in derived:
+            continue
+        derived.add(symbol)
+        for index in occurrences.get(symbol, ()):
+            remaining[index] -= 1
+            if remaining[index] == 0:
+                pending.append(lhs[index])
+    return derived
+
+
+def strongly_connected_components(successors: List[List[int]]) -> List[List[int]]:
+    """
+    The strongly connected components of the graph over range(len(successors)), in
+    reverse topological order: a component comes after every component it points to.
+    Tarjan's algorithm, with an explicit call stack so deep graphs don't recurse.
+    """
+    components: List[List[int]] = []
+    order = [-1] * len(successors)
+    low_link = [0] * len(successors)
+    on_stack = [False] * len(successors)
+    stack: List[int] = []
+    counter = 0
+    for root in range(len(successors)):
+        if order[root] != -1:
+            continue
+        # iterative depth-first search: (node, index of the next successor)
+        call_stack = [(root, 0)]
+        while call_stack:
+            node, child = call_stack.pop()
+            if child == 0:
+                order[node] = low_link[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            else:
+                low_link[node] = min(
+                    low_link[node], low_link[successors[node][child - 1]]
+                )
+            while child < len(successors[node]):
+                successor = successors[node][child]
+                child += 1
+                if order[successor] == -1:
+                    call_stack.append((node, child))
+                    call_stack.append((successor, 0))
+                    break
+                if on_stack[successor]:
+                    low_link[node] = min(low_link[node], order[successor])
+            else:
+                if low_link[node] == order[node]:
+                    components.append(_pop_component(node, stack, on_stack))
+    return components
+
+
+def _pop_component(root: int, stack: List[int], on_stack: List[bool]) -> List[int]:
+    members = []
+    while True:
+        member = stack.pop()
+        on_stack[member] = False
+        members.append(member)
+        if member == root:
+            return members
@@ -0,0 +1,460 @@
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from piu.exceptions.base import GrammarException
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants  # pylint: disable=deprecated-module
+    import sre_parse  # pylint: disable=deprecated-module
+
+# sorted, disjoint and inclusive (low, high) code point ranges
+CharRanges = Tuple[Tuple[int, int], ...]
+
+ALL_CHARS: CharRanges = ((0, sys.maxunicode),)
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+_category_ranges: Dict[Tuple[str, bool], CharRanges] = {}
+
+
+def merge_ranges(ranges) -> CharRanges:
+    merged: List[List[int]] = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return tuple((low, high) for low, high in merged)
+
+
+def negate_ranges(ranges: CharRanges) -> CharRanges:
+    negated = []
+    low = 0
+    for start, end in ranges:
+        if start > low:
+            negated.append((low, start - 1))
+        low = end + 1
+    if low <= sys.maxunicode:
+        negated.append((low, sys.maxunicode))
+    return tuple(negated)
+
+
+def format_ranges(ranges: CharRanges) -> str:
+    return (
+        "["
+        + ", ".join(
+            repr(chr(low)) if low == high else f"{chr(low)!r}-{chr(high)!r}"
+            for low, high in ranges
+        )
+        + "]"
+    )
+
+
+def _category(category, ascii_only: bool) -> CharRanges:
+    """
+    The code points of a \\d, \\s or \\w class and their negations, found once by
+    matching the class against every code point
+    """
+    key = (_CATEGORIES[category], ascii_only)
+    ranges = _category_ranges.get(key)
+    if ranges is None:
+        chars = "".join(map(chr, range(sys.maxunicode + 1)))
+        matcher = re.compile(key[0] + "+", re.ASCII if ascii_only else 0)
+        ranges = tuple(
+            (match.start(), match.end() - 1) for match in matcher.finditer(chars)
+        )
+        _category_ranges[key] = ranges
+    return ranges
+
+
+def _fold_case(ranges: CharRanges) -> CharRanges:
+    """
+    Add the other case of every char. Wide ranges (negated sets, \\S...) already hold
+    both cases of nearly everything and are left as they are.
+    """
+    folded = list(ranges)
+    for low, high in ranges:
+        if high - low > 0x1000:
+            continue
+        for code in range(low, high + 1):
+            for other in (chr(code).lower(), chr(code).upper()):
+                if len(other) == 1:
+                    folded.append((ord(other), ord(other)))
+    return merge_ranges(folded)
+
+
+class NFA:  # pylint: disable=too-many-instance-attributes
+    """
+    A Thompson NFA built from a regex parsed by sre_parse, with edges labelled by code
+    point ranges.
+
+    One char lookbehinds, such as the (?<!\\\\) of Lark's ESCAPED_STRING, are
+    epsilon edges guarded by the char consumed just before them.
+
+    A pattern with lazy repeats stops at its shortest match, which is what re.match
+    finds as long as no repeat is greedy. Lazy and greedy repeats together, as in
+    a*?b+, need the priority of every repeat kept apart and are not supported.
+    """
+
+    def __init__(self, regex: str):
+        self.edges: List[List[Tuple[CharRanges, int]]] = []
+        self.epsilons: List[List[int]] = []
+        # (chars, negated, target): followed if the previous char is (not) in chars
+        self.lookbehinds: List[List[Tuple[CharRanges, bool, int]]] = []
+        self.lazy = False
+        # repeats with a choice of how many times to match, lazy ones aside
+        self.greedy = False
+
+        try:
+            parsed = sre_parse.parse(regex)
+        except re.error as e:
+            raise GrammarException(f"Invalid terminal pattern {regex!r}: {e}") from e
+        self.regex = regex
+        self.start = self.add_state()
+        self.end = self._build(parsed, self.start, parsed.state.flags)
+        if self.lazy and self.greedy:
+            raise self._unsupported("lazy and greedy repeats together")
+
+    def add_state(self) -> int:
+        self.edges.append([])
+        self.epsilons.append([])
+        self.lookbehinds.append([])
+        return len(self.edges) - 1
+
+    def _unsupported(self, op) -> GrammarException:
+        return GrammarException(
+            f"Unsupported regex construct {op} in terminal pattern {self.regex!r}"
+        )
+
+    def _chars(self, op, av, flags: int) -> Optional[CharRanges]:
+        """
+        The chars matched by a single char item, None if the item is not one
+        """
+        ascii_only = bool(flags & sre_constants.SRE_FLAG_ASCII)
+        negated = False
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+            negated = op == sre_constants.NOT_LITERAL
+            ranges: CharRanges = ((av, av),)
+        elif op == sre_constants.ANY:
+            if flags & sre_constants.SRE_FLAG_DOTALL:
+                return ALL_CHARS
+            return negate_ranges(((10, 10),))
+        elif op == sre_constants.IN:
+            items = []
+            for item_op, item_av in av:
+                if item_op == sre_constants.NEGATE:
+                    negated = True
+                elif item_op == sre_constants.LITERAL:
+                    items.append((item_av, item_av))
+                elif item_op == sre_constants.RANGE:
+                    items.append(item_av)
+                elif item_op == sre_constants.CATEGORY:
+                    items.extend(_category(item_av, ascii_only))
+                else:
+                    raise self._unsupported(item_op)
+            ranges = merge_ranges(items)
+        else:
+            return None
+
+        if flags & sre_constants.SRE_FLAG_IGNORECASE:
+            ranges = _fold_case(ranges)
+        return negate_ranges(ranges) if negated else ranges
+
+    # pylint: disable-next=too-many-branches
+    def _build(self, pattern, state: int, flags: int) -> int:
+        """
+        Add the states matching pattern from state and return the state it ends in
+        """
+        for op, av in pattern:
+            chars = self._chars(op, av, flags)
+            if chars is not None:
+                target = self.add_state()
+                self.edges[state].append((chars, target))
+                state = target
+            elif op == sre_constants.BRANCH:
+                end = self.add_state()
+                for alternative in av[1]:
+                    self.epsilons[self._build(alternative, state, flags)].append(end)
+                state = end
+            elif op == sre_constants.SUBPATTERN:
+                _, add_flags, del_flags, subpattern = av
+                state = self._build(subpattern, state, (flags | add_flags) & ~del_flags)
+            elif op in (
+                sre_constants.MAX_REPEAT,
+                sre_constants.MIN_REPEAT,
+                getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+            ):
+                state = self._build_repeat(op, av, state, flags)
+            elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                direction, subpattern = av
+                chars = None
+                if direction < 0 and len(subpattern) == 1:
+                    chars = self._chars(*subpattern[0], flags)
+                if chars is None:
+                    raise self._unsupported(op)
+                target = self.add_state()
+                self.lookbehinds[state].append(
+                    (chars, op == sre_constants.ASSERT_NOT, target)
+                )
+                state = target
+            else:
+                raise self._unsupported(op)
+        return state
+
+    def _build_repeat(self, op, av, state: int, flags: int) -> int:
+        minimum, maximum, subpattern = av
+        if op == sre_constants.MIN_REPEAT:
+            self.lazy = True
+        elif maximum != minimum:
+            self.greedy = True
+        for _ in range(minimum):
+            state = self._build(subpattern, state, flags)
+        if maximum == sre_constants.MAXREPEAT:
+            loop = self.add_state()
+            self.epsilons[state].append(loop)
+            self.epsilons[self._build(subpattern, loop, flags)].append(loop)
+            return loop
+        end = self.add_state()
+        self.epsilons[state].append(end)
+        for _ in range(maximum - minimum):
+            state = self._build(subpattern, state, flags)
+            self.epsilons[state].append(end)
+        return end
+
+
+class DFA:
+    """
+    A DFA matching one terminal char by char.
+
+    Chars are mapped to classes of chars the DFA never tells apart: an ASCII char
+    through a 128 entry table, any other one by a binary search over the code points
+    where the class changes. transitions[state * num_classes + char_class] is the next
+    state, or -1 once no continuation can be accepted any more.
+    """
+
+    __slots__ = (
+        "starts",
+        "classes",
+        "ascii_classes",
+        "num_classes",
+        "transitions",
+        "accepting",
+        "_char_ranges",
+    )
+
+    def __init__(self, nfa: NFA):
+        class_starts = self._partition(nfa)
+        rows = self._determinize(nfa, class_starts)
+        live = self._live(rows)
+        if not live[0]:
+            raise GrammarException(
+                f"The terminal pattern {nfa.regex!r} matches nothing"
+            )
+        # dead states are dropped, their transitions become -1
+        numbers = {}
+        for index, is_live in enumerate(live):
+            if is_live:
+                numbers[index] = len(numbers)
+
+        # classes every live state treats the same are merged
+        columns: Dict[Tuple[int, ...], int] = {}
+        merged = [
+            columns.setdefault(
+                tuple(numbers.get(rows[index][1].get(k), -1) for index in numbers),
+                len(columns),
+            )
+            for k in range(len(class_starts))
+        ]
+
+        self.num_classes = len(columns)
+        self.transitions = array("i", [-1]) * (len(numbers) * self.num_classes)
+        for column, k in columns.items():
+            for state, target in enumerate(column):
+                self.transitions[state * self.num_classes + k] = target
+        self.accepting = bytes(rows[index][0] for index in numbers)
+
+        # runs of neighbouring classes merged into the same class are joined
+        self.starts = array("i")
+        self.classes = array("i")
+        for low, k in zip(class_starts, merged):
+            if not self.classes or self.classes[-1] != k:
+                self.starts.append(low)
+                self.classes.append(k)
+        self.ascii_classes = array("i", (self._lookup(code) for code in range(128)))
+        self._char_ranges: Dict[int, CharRanges] = {}
+
+    @classmethod
+    def from_regex(cls, regex: str) -> "DFA":
+        return cls(NFA(regex))
+
+    @classmethod
+    def from_literal(cls, text: str) -> "DFA":
+        return cls(NFA(re.escape(text)))
+
+    @staticmethod
+    def _partition(nfa: NFA) -> List[int]:
+        """
+        Split the code points at every range boundary of the NFA, so an edge or a
+        lookbehind either covers a whole class or none of it, and return the first
+        code point of every class
+        """
+        boundaries = {0}
+        for edges in nfa.edges:
+            for chars, _ in edges:
+                for low, high in chars:
+                    boundaries.update((low, high + 1))
+        for lookbehinds in nfa.lookbehinds:
+            for chars, _, _ in lookbehinds:
+                for low, high in chars:
+                    boundaries.update((low, high + 1))
+        return sorted(b for b in boundaries if b <= sys.maxunicode)
+
+    @staticmethod
+    def _covered(class_starts: List[int], chars: CharRanges) -> FrozenSet[int]:
+        return frozenset(
+            k
+            for low, high in chars
+            for k in range(
+                bisect_right(class_starts, low) - 1, bisect_right(class_starts, high)
+            )
+        )
+
+    @staticmethod
+    def _closure(nfa: NFA, states, previous: Optional[int]) -> FrozenSet[int]:
+        """
+        The states reachable through epsilon edges, with lookbehinds checked against
+        the previous code point (None before the first char)
+        """
+        seen = set(states)
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            targets = list(nfa.epsilons[state])
+            for chars, negated, target in nfa.lookbehinds[state]:
+                inside = previous is not None and any(
+                    low <= previous <= high for low, high in chars
+                )
+                if inside != negated:
+                    targets.append(target)
+            for target in targets:
+                if target not in seen:
+                    seen.add(target)
+                    pending.append(target)
+        return frozenset(seen)
+
+    @classmethod
+    # pylint: disable-next=too-many-locals
+    def _determinize(
+        cls, nfa: NFA, class_starts: List[int]
+    ) -> List[Tuple[bool, Dict[int, int]]]:
+        """
+        The subset construction: one (accepting, {char class: next state}) row per set
+        of NFA states reachable from the start, the start being row 0.
+        A lazy pattern stops at its first accepting state.
+        """
+        moves = [
+            [(cls._covered(class_starts, chars), target) for chars, target in edges]
+            for edges in nfa.edges
+        ]
+        start = cls._closure(nfa, (nfa.start,), None)
+        states: Dict[FrozenSet[int], int] = {start: 0}
+        pending = [start]
+        rows: List[Tuple[bool, Dict[int, int]]] = []
+        while pending:
+            current = pending.pop(0)
+            row: Dict[int, int] = {}
+            rows.append((nfa.end in current, row))
+            if nfa.lazy and nfa.end in current:
+                continue
+            targets: Dict[int, List[int]] = {}
+            for state in current:
+                for edge_classes, target in moves[state]:
+                    for k in edge_classes:
+                        targets.setdefault(k, []).append(target)
+            for k, k_targets in targets.items():
+                following = cls._closure(nfa, k_targets, class_starts[k])
+                if following not in states:
+                    states[following] = len(states)
+                    pending.append(following)
+                row[k] = states[following]
+        return rows
+
+    @staticmethod
+    def _live(rows: List[Tuple[bool, Dict[int, int]]]) -> List[bool]:
+        """
+        The states from which an accepting state can still be reached
+        """
+        parents: List[List[int]] = [[] for _ in rows]
+        for index, (_, row) in enumerate(rows):
+            for following in row.values():
+                parents[following].append(index)
+        live = [accepting for accepting, _ in rows]
+        pending = [index for index, accepting in enumerate(live) if accepting]
+        while pending:
+            for parent in parents[pending.pop()]:
+                if not live[parent]:
+                    live[parent] = True
+                    pending.append(parent)
+        return live
+
+    def _lookup(self, code: int) -> int:
+        return self.classes[bisect_right(self.starts, code) - 1]
+
+    def char_class(self, char: str) -> int:
+        code = ord(char)
+        if code < 128:
+            return self.ascii_classes[code]
+        return self.classes[bisect_right(self.starts, code) - 1]
+
+    def step(self, state: int, char: str) -> int:
+        return self.transitions[state * self.num_classes + self.char_class(char)]
+
+    def run(self, state: int, text: str, start: int = 0) -> Tuple[int, int]:
+        """
+        Step from state along text[start:] while the match stays alive. Return the last
+        live state and the index of the first char it does not take, len(text) if all.
+        """
+        transitions = self.transitions
+        ascii_classes = self.ascii_classes
+        num_classes = self.num_classes
+        for index in range(start, len(text)):
+            code = ord(text[index])
+            if code < 128:
+                k = ascii_classes[code]
+            else:
+                k = self.classes[bisect_right(self.starts, code) - 1]
+            target = transitions[state * num_classes + k]
+            if target < 0:
+                return state, index
+            state = target
+        return state, len(text)
+
+    def accepts(self, state: int) -> bool:
+        return self.accepting[state] == 1
+
+    def char_ranges(self, state: int) -> CharRanges:
+        """
+        The chars that keep the match alive from a state
+        """
+        ranges = self._char_ranges.get(state)
+        if ranges is None:
+            row = state * self.num_classes
+            ends = list(self.starts[1:]) + [sys.maxunicode + 1]
+            ranges = merge_ranges(
+                (low, end - 1)
+                for low, end, k in zip(self.starts, ends, self.classes)
+                if self.transitions[row + k] >= 0
+            )
+            self._char_ranges[state] = ranges
+        return ranges
@@ -0,0 +1,193 @@
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.converters.utils import derive_bottom_up
+from piu.grammars.element import EmptyElement, RuleRefElement
+from piu.grammars.parser import BaseParser, Stack
+
+# (production, dot, origin set): the production is matched up to the dot since origin
+Item = Tuple[int, int, "EarleySet"]
+
+
+class EarleySet:
+    """
+    The Earley items reached after the same input. Items point to the set they started
+    in, so the current set keeps alive exactly the part of the chart that can still be
+    completed.
+
+    key describes that part of the chart by content: the production and dot of every
+    item with the key of its origin set, None for the set itself. Sets reached by
+    different inputs but completing the same way get equal keys.
+    """
+
+    __slots__ = ("items", "scan", "waiting", "key")
+
+    def __init__(self):
+        self.items: Dict[Item, None] = {}
+        # items by the terminal after their dot
+        self.scan: Dict[int, List[Item]] = {}
+        # items by the non-terminal after their dot, for the completer
+        self.waiting: Dict[int, List[Item]] = {}
+        self.key: Optional[FrozenSet[Tuple[int, int, Any]]] = None
+
+
+class EarleyParser(BaseParser):
+    """
+    A next char predictor running an incremental Earley recognizer on the grammar as it
+    is, without the CNF and GNF conversions: left recursion and empty productions are
+    fine, so it takes BackusGrammar exports directly.
+
+    The state is the current Earley set; add_char scans the terminal into a new set and
+    closes it with the predictor and the completer. Empty productions are handled as in
+    Aycock and Horspool: predicting a nullable non-terminal also moves the dot over it.
+    """
+
+    def __init__(
+        self,
+        grammar: Union[Dict[RuleRefElement, List[Stack]], CompiledGrammar],
+        initial_rule: RuleRefElement,
+        verbose: bool = True,
+        cache: Optional[StateCache] = None,
+    ):
+        super().__init__(grammar, initial_rule, verbose, cache)
+        grammar = self.grammar
+        # CompiledGrammar ends the start productions with the end marker, which would
+        # also be expected after every nested use of a recursive start symbol. Here the
+        # productions are kept as written and one extra production, start END, is the
+        # root of the parse.
+        skipped = {grammar.symbol_ids.get(EmptyElement()), CompiledGrammar.END_ID}
+        self._lhs = [0] * grammar.num_productions
+        self._rhs: List[Tuple[int, ...]] = []
+        for non_terminal in range(grammar.num_terminals, grammar.num_symbols):
+            for production in grammar.productions(non_terminal):
+                self._lhs[production] = non_terminal
+                self._rhs.append(
+                    tuple(
+                        symbol
+                        for symbol in grammar.production(production)
+                        if symbol not in skipped
+                    )
+                )
+        root = len(self._rhs)
+        self._lhs.append(-1)
+        self._rhs.append((grammar.start_id, CompiledGrammar.END_ID))
+        self._nullable = self._find_nullable()
+
+        start = EarleySet()
+        self.current = self._close(start, [(root, 0, start)])
+
+        self._print_state()
+
+    def _validate_gnf(self):
+        return True
+
+    def _find_nullable(self) -> FrozenSet[int]:
+        # a terminal never derives ε, so only the all non-terminal productions can fire
+        return frozenset(
+            derive_bottom_up(
+                (
+                    lhs,
+                    (
+                        None
+                        if any(self.grammar.is_terminal(symbol) for symbol in rhs)
+                        else rhs
+                    ),
+                )
+                for lhs, rhs in zip(self._lhs, self._rhs)
+            )
+        )
+
+    def _print_state(self):
+        if not self.verbose:
+            return
+        print("-----------------")
+        print("Number of items: ", len((self._boundary() or self).current.items))
+        print("Allowed chars: ", self._describe_allowed_chars())
+
+    def top_symbols(self) -> Iterable[int]:
+        return iter(self.current.scan)
+
+    def _make_fingerprint(self, depth: Optional[int]) -> Hashable:
+        # the chart has no stack to cut, every depth gives the full configuration
+        return self.current.key
+
+    def _get_state(self) -> EarleySet:
+        return self.current
+
+    def _set_state(self, state: EarleySet):
+        self.current = state
+
+    def _close(self, earley_set: EarleySet, items: List[Item]) -> EarleySet:
+        """
+        Add the items to the set along with everything the predictor and the completer
+        derive from them
+        """
+        grammar = self.grammar
+        pending = []
+        for item in items:
+            if item not in earley_set.items:
+                earley_set.items[item] = None
+                pending.append(item)
+
+        while pending:
+            production, dot, origin = pending.pop()
+            rhs = self._rhs[production]
+            derived: List[Item] = []
+            if dot == len(rhs):
+                lhs = self._lhs[production]
+                derived.extend(
+                    (parent, parent_dot + 1, parent_origin)
+                    for parent, parent_dot, parent_origin in origin.waiting.get(lhs, ())
+                )
+            else:
+                symbol = rhs[dot]
+                if grammar.is_terminal(symbol):
+                    earley_set.scan.setdefault(symbol, []).append(
+                        (production, dot, origin)
+                    )
+                else:
+                    waiting = earley_set.waiting.get(symbol)
+                    if waiting is None:
+                        waiting = earley_set.waiting[symbol] = []
+                        derived.extend(
+                            (child, 0, earley_set)
+                            for child in grammar.productions(symbol)
+                        )
+                    waiting.append((production, dot, origin))
+                    if symbol in self._nullable:
+                        derived.append((production, dot + 1, origin))
+            for item in derived:
+                if item not in earley_set.items:
+                    earley_set.items[item] = None
+                    pending.append(item)
+
+        earley_set.key = frozenset(
+            (production, dot, None if origin is earley_set else origin.key)
+            for production, dot, origin in earley_set.items
+        )
+        return earley_set
+
+    def _advance(self, terminals: FrozenSet[int]) -> bool:
+        """
+        Scan the terminals into a new Earley set
+        """
+        items = [
+            (production, dot + 1, origin)
+            for terminal in terminals
+            for production, dot, origin in self.current.scan.get(terminal, ())
+        ]
+        if not items:
+            return False
+        self.current = self._close(EarleySet(), items)
+        return True
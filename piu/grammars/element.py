@@ -1,17 +1,53 @@
+from typing import Hashable, Tuple
+from weakref import WeakValueDictionary
+
 from lark.lexer import TerminalDef
 
 
-class Element:
+class InternedElementType(type):
+    """
+    Makes elements flyweights: creating an element equal to a live one returns that
+    object, so equality is identity and hashing reads a cached value.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        cls._instances = WeakValueDictionary()
+
+    def __call__(cls, *args):
+        key = cls.intern_key(*args)
+        element = cls._instances.get(key)
+        if element is None:
+            element = super().__call__(*args)
+            element._args = args
+            cls._instances[key] = element
+        return element
+
+
+class Element(metaclass=InternedElementType):
+
+    __slots__ = ("value", "_hash", "_sort_key", "_args", "__weakref__")
 
     def __init__(self, value: str):
         self.value: str = value
+        # the same hash and order as when they were computed on every call
+        self._hash = hash(value + str(type(self)))
+        self._sort_key = str(type(self)) + value
+
+    @classmethod
+    def intern_key(cls, *args) -> Hashable:
+        return args
+
+    # equal elements are the same object, so the inherited identity __eq__ is kept
+
+    def __hash__(self) -> int:
+        return self._hash
 
-    def __eq__(self, other: "Element"):
-        # pylint: disable=unidiomatic-typecheck
-        return type(self) == type(other) and self.value == other.value
+    def __lt__(self, other: "Element"):
+        return self._sort_key < other._sort_key
 
     def __gt__(self, other: "Element"):
-        return str(type(self)) + self.value > str(type(other)) + other.value
+        return self._sort_key > other._sort_key
 
     def __str__(self):
         return f" {self.value}"
@@ -19,25 +55,44 @@ class Element:
     def __repr__(self) -> str:
         return self.__str__()
 
-    def __hash__(self) -> int:
-        return hash(self.value + str(type(self)))
+    def __reduce__(self) -> Tuple[type, tuple]:
+        # unpickling calls the class, which returns the interned element
+        return type(self), self._args
+
+    def __copy__(self) -> "Element":
+        return self
+
+    def __deepcopy__(self, memo) -> "Element":
+        return self
 
 
 class RuleRefElement(Element):
     """Element for rule_ref"""
 
+    __slots__ = ()
+
 
 class TerminalElement(Element):
     """Element for terminal"""
 
+    __slots__ = ("definition",)
+
     def __init__(self, value: str, definition: TerminalDef):
         super().__init__(value)
         self.definition = definition
 
+    @classmethod
+    def intern_key(cls, *args) -> Hashable:
+        # terminals of different grammars may share a name but not a pattern
+        value, definition = args
+        return value, None if definition is None else definition.pattern
+
 
 class EndElement(Element):
     """Element for end"""
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("$")
 
@@ -45,5 +100,11 @@ class EndElement(Element):
 class EmptyElement(TerminalElement):
     """Element for empty"""
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("ε", None)
+
+    @classmethod
+    def intern_key(cls, *args) -> Hashable:
+        return args
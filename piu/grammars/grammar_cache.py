@@ -0,0 +1,207 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from importlib import metadata
+from typing import Dict, Optional
+
+import lark
+
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.converters.bnf.backus import BackusGrammar
+from piu.grammars.converters.cnf.chomsky import ChomskyGrammar
+from piu.grammars.converters.gnf.greibach import GreibachGrammar
+
+# bump when the pickled CompiledGrammar changes shape
+CACHE_FORMAT = 3
+
+# the modules, relative to piu/grammars, whose code decides the compiled tables
+CONVERSION_SOURCES = ("converters", "compiled.py", "dfa.py", "element.py")
+
+
+try:
+    LIBRARY_VERSION = metadata.version("piu")
+except metadata.PackageNotFoundError:
+    LIBRARY_VERSION = "unknown"
+
+
+def _sources_digest() -> str:
+    """
+    A SHA-256 of the conversion and compilation sources, so editing them invalidates
+    the entries they built even when the version stays the same, as it does in a
+    checkout or an editable install
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+    for source in CONVERSION_SOURCES:
+        path = os.path.join(root, source)
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                paths.extend(
+                    os.path.join(directory, name)
+                    for name in files
+                    if name.endswith(".py")
+                )
+        else:
+            paths.append(path)
+
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        digest.update(relative.encode("utf-8"))
+        try:
+            with open(path, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        except OSError:
+            # sources shipped only as bytecode leave the version to tell builds apart
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+SOURCES_DIGEST = _sources_digest()
+
+
+def compile_grammar(bnf_grammar: str, start: str) -> CompiledGrammar:
+    """
+    Run the whole BNF -> CNF -> GNF conversion and compile the result
+    """
+    bnf = BackusGrammar(bnf_grammar, start=start)
+    cnf = ChomskyGrammar(bnf.export_grammar(), bnf.start_symbol)
+    gnf = GreibachGrammar(cnf.export_grammar(), cnf.start_symbol)
+    return CompiledGrammar(gnf.export_grammar(), gnf.start_symbol)
+
+
+class GrammarCache:
+    """
+    A content-addressed cache of compiled grammars, so a warm start loads the tables
+    instead of running the conversion passes.
+
+    Entries are keyed by a SHA-256 of the grammar text, the start rule, the versions
+    of piu, Lark and the cache format and a digest of the conversion sources. Lookups
+    go through an in-memory LRU layer and then, when a directory is given, an on-disk
+    layer of pickles shared by every process using it. The disk layer keeps at most
+    max_bytes, evicting the files read or written the longest ago. Pickles are trusted:
+    the directory must not be writable by anyone who should not run code in the
+    processes reading it.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entries: int = 64,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = StateCache(max_entries=max_entries)
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(bnf_grammar: str, start: str) -> str:
+        digest = hashlib.sha256()
+        for part in (
+            str(CACHE_FORMAT),
+            LIBRARY_VERSION,
+            SOURCES_DIGEST,
+            lark.__version__,
+            start,
+            bnf_grammar,
+        ):
+            data = part.encode("utf-8")
+            # length prefixes keep the parts from running into each other
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, bnf_grammar: str, start: str) -> CompiledGrammar:
+        """
+        The compiled grammar, converted only if no layer has it
+        """
+        key = self.key(bnf_grammar, start)
+        grammar = self.memory.get(key)
+        if grammar is not None:
+            return grammar
+
+        grammar = self._load(key)
+        if grammar is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            grammar = compile_grammar(bnf_grammar, start)
+            self._store(key, grammar)
+        self.memory.put(key, grammar)
+        return grammar
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pickle")
+
+    def _load(self, key: str) -> Optional[CompiledGrammar]:
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                grammar = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            # a corrupted or outdated entry is dropped and rebuilt
+            self._remove(path)
+            return None
+        if not isinstance(grammar, CompiledGrammar):
+            self._remove(path)
+            return None
+        try:
+            # the modification time is the recency used by the eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return grammar
+
+    def _store(self, key: str, grammar: CompiledGrammar):
+        if self.directory is None:
+            return
+        # written aside then renamed, so concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(grammar, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            self._remove(temp_path)
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,149 @@
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from weakref import WeakValueDictionary
+
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.element import RuleRefElement
+from piu.grammars.parser import BaseParser, Stack
+
+
+class Node:
+    """
+    A node of the graph-structured stack: one symbol on top of a set of nodes below it.
+    Every path from a frontier node down to a node with nothing below is one stack.
+    """
+
+    __slots__ = ("symbol", "below", "__weakref__")
+
+    def __init__(self, symbol: int, below: Tuple["Node", ...]):
+        self.symbol = symbol
+        self.below = below
+
+
+# a node cut at a depth: its symbol and the shapes of the nodes below it
+Shape = Tuple[int, FrozenSet[Any]]
+
+
+class GSSParser(BaseParser):
+    """
+    A next char predictor using GNF grammar, with all stacks kept in one
+    graph-structured stack (GSS).
+
+    Stacks share their common suffixes instead of being copied, and nodes are
+    hash-consed: a node holding the same symbol on top of the same nodes as a live
+    node is that node. A configuration reached twice is then made of the same nodes,
+    which makes the set of frontier nodes a cheap fingerprint of it.
+    A step only touches the frontier (the top nodes) and the nodes it pushes, so its
+    cost scales with the live frontier rather than with the depth of the stacks.
+    """
+
+    def __init__(
+        self,
+        grammar: Union[Dict[RuleRefElement, List[Stack]], CompiledGrammar],
+        initial_rule: RuleRefElement,
+        verbose: bool = True,
+        cache: Optional[StateCache] = None,
+    ):
+        super().__init__(grammar, initial_rule, verbose, cache)
+        # live nodes by (symbol, below), shared with every fork
+        self._nodes: "WeakValueDictionary[Tuple[int, Tuple[Node, ...]], Node]" = (
+            WeakValueDictionary()
+        )
+        self.frontier: List[Node] = self._expand({self.grammar.start_id: {}})
+
+        self._print_state()
+
+    def _print_state(self):
+        if not self.verbose:
+            return
+        print("-----------------")
+        print("Number of stack tops: ", len((self._boundary() or self).frontier))
+        print("Allowed chars: ", self._describe_allowed_chars())
+
+    def top_symbols(self) -> Iterable[int]:
+        return (node.symbol for node in self.frontier)
+
+    def _make_fingerprint(self, depth: Optional[int]) -> Hashable:
+        if depth is None:
+            return frozenset(self.frontier)
+
+        # A node cut at a depth is its symbol and the set of the nodes below it cut one
+        # level shallower, so equal top parts of the stacks are equal keys no matter how
+        # many paths lead to them. Shapes are built once per node and depth within a
+        # fingerprint, and nothing outlives it but the key itself.
+        cut: Dict[Tuple[Node, int], Shape] = {}
+
+        def shape(node: Node, depth: int) -> Shape:
+            key = (node, depth)
+            node_shape = cut.get(key)
+            if node_shape is None:
+                below: FrozenSet[Shape] = frozenset()
+                if depth > 1:
+                    below = frozenset(shape(child, depth - 1) for child in node.below)
+                node_shape = cut[key] = (node.symbol, below)
+            return node_shape
+
+        return frozenset(shape(node, depth) for node in self.frontier)
+
+    def _get_state(self) -> List[Node]:
+        return self.frontier
+
+    def _set_state(self, state: List[Node]):
+        self.frontier = state
+
+    def _expand(self, pending: Dict[int, Dict[Node, None]]) -> List[Node]:
+        """
+        Replace every pending non-terminal by its productions, pushed on top of the
+        nodes that were below it, and return the new top nodes
+        """
+        nodes = self._nodes
+        tops: Dict[Node, None] = {}
+        for non_terminal, below in pending.items():
+            # a canonical order, so the same set of nodes gives the same key
+            below = tuple(sorted(below, key=id))
+            for seq in self.grammar.expansions(non_terminal):
+                node_below = below
+                for symbol in seq:
+                    key = (symbol, node_below)
+                    node = nodes.get(key)
+                    if node is None:
+                        node = nodes[key] = Node(symbol, node_below)
+                    node_below = (node,)
+                tops[node] = None
+        return list(tops)
+
+    def _advance(self, terminals: FrozenSet[int]) -> bool:
+        """
+        Pop the frontier nodes holding one of the terminals and expand the non-terminals uncovered below them
+        """
+        frontier: Dict[Node, None] = {}
+        pending: Dict[int, Dict[Node, None]] = {}
+        accepted = False
+        for top in self.frontier:
+            if top.symbol not in terminals:
+                continue
+            accepted = True
+            for node in top.below:
+                if self.grammar.is_terminal(node.symbol):
+                    frontier[node] = None
+                else:
+                    pending.setdefault(node.symbol, {}).update(
+                        dict.fromkeys(node.below)
+                    )
+
+        if not accepted:
+            return False
+
+        frontier.update(dict.fromkeys(self._expand(pending)))
+        self.frontier = list(frontier)
+        return True
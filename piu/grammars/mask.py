@@ -0,0 +1,22 @@
+from typing import Any
+
+
+class MaskWriter:
+    """
+    Writes allowed flags in place into a caller-owned one byte per entry buffer, such as
+    a bytearray or a NumPy bool/uint8 array.
+
+    The byte view and the zero block used to clear the buffer are built once, so filling
+    the mask on every step allocates nothing per entry. A NumPy mask can then be applied
+    to a logits row with one vectorized operation, e.g. logits[~mask] = -inf.
+    """
+
+    __slots__ = ("out", "view", "zeros")
+
+    def __init__(self, out: Any):
+        self.out = out
+        self.view = memoryview(out).cast("B")
+        self.zeros = bytes(len(self.view))
+
+    def clear(self):
+        self.view[:] = self.zeros
@@ -1,6 +1,24 @@
-from typing import List, Dict
 import copy
-from piu.grammars.element import Element, TerminalElement, RuleRefElement, EndElement
+from itertools import islice
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.dfa import CharRanges, format_ranges, merge_ranges
+from piu.grammars.element import Element, RuleRefElement
+from piu.grammars.mask import MaskWriter
 from piu.exceptions.base import GrammarException
 
 
@@ -50,84 +68,665 @@ def print_stacks(stacks: List[Stack]):
         print(stack)
 
 
-class Parser:
+# the terminals a lexeme may still be, with the DFA state of each
+Lexeme = Tuple[Tuple[int, int], ...]
+
+
+class BaseParser:
     """
-    A next char predictor using GNF grammar
+    The interface shared by the GNF parsers: a compiled grammar, a parser state that
+    add_char replaces instead of mutating, and the allowed next symbols on top of it.
     """
 
     def __init__(
-        self, grammar: Dict[RuleRefElement, List[Stack]], initial_rule: RuleRefElement
+        self,
+        grammar: Union[Dict[RuleRefElement, List[Stack]], CompiledGrammar],
+        initial_rule: RuleRefElement,
+        verbose: bool = True,
+        cache: Optional[StateCache] = None,
     ):
+        if not isinstance(grammar, CompiledGrammar):
+            grammar = CompiledGrammar(grammar, initial_rule)
         self.grammar = grammar
 
         if not self._validate_gnf():
             raise GrammarException("The grammar is not GNF")
 
         self.initial_rule = initial_rule
+        self.verbose = verbose
+        self.cache = cache
+        self._mask: Optional[MaskWriter] = None
+        # the terminals being matched char by char, with their DFA states
+        self._lexeme: Lexeme = ()
+        # results computed for the current state, replaced (never cleared) on every step
+        # since forks share it
+        self._memo: Dict[Hashable, Any] = {}
+
+    def _validate_gnf(self):
+        return self.grammar.is_gnf()
+
+    def fork(self):
+        """
+        A quiet copy of the parser sharing the compiled grammar.
+        add_char replaces the parser state instead of mutating it, so nothing is copied.
+        """
+        parser = copy.copy(self)
+        parser.verbose = False
+        return parser
+
+    def checkpoint(self) -> Any:
         """
-        The stacks are initialized with the first rule of the grammar. For example, if the grammar is:
-        S -> aABe | bBAe
-        ...
-        The stacks are initialized with:
-        [a,A,B,e]
-        [b,B,A,e]
+        An opaque token of the current parser state for rollback, taken in O(1): states
+        are replaced and never modified, so the token only holds references to them
         """
-        self.stacks: List[Stack] = []
+        return (self._get_state(), self._lexeme, self._memo)
 
-        self.grammar[self.initial_rule] = [
-            seq + [EndElement()] for seq in self.grammar[self.initial_rule]
-        ]
+    def rollback(self, checkpoint: Any):
+        """
+        Restore the state of a checkpoint taken on this parser or on one of its forks
+        """
+        self._restore(checkpoint)
+        self._print_state()
 
-        for seq in self.grammar[self.initial_rule]:
-            self.stacks.append(Stack(seq))
+    def _restore(self, checkpoint: Any):
+        state, self._lexeme, self._memo = checkpoint
+        self._set_state(state)
 
-        print("-----------------")
-        print_stacks(self.stacks)
-        print("Number of stacks: ", len(self.stacks))
-        print("Allowed chars: ", self._get_allowed_next_chars())
+    def top_symbols(self) -> Iterable[int]:
+        """
+        The symbol ids on top of the live stacks, possibly repeated
+        """
+        raise NotImplementedError
 
-    def _validate_gnf(self):
-        for seqs in self.grammar.values():
-            for seq in seqs:
-                if not isinstance(seq[0], TerminalElement):
-                    return False
+    def fingerprint(self, depth: Optional[int] = None) -> Hashable:
+        """
+        A hashable key of the parser configuration: equal fingerprints mean the same
+        configuration, so anything computed from one state can be reused for the other.
+
+        With a depth, only the top depth symbols of every stack are kept. Consuming n chars
+        touches at most the top 2n symbols of a stack, so this key is enough for anything
+        that looks n chars ahead and it repeats far more often than the full
+        configuration.
+        Fingerprints are computed once per state and depth.
+        """
+        return (self._lexeme, self._stacks_fingerprint(depth))
+
+    def _stacks_fingerprint(self, depth: Optional[int]) -> Hashable:
+        key = ("fingerprint", depth)
+        fingerprint = self._memo.get(key)
+        if fingerprint is None:
+            fingerprint = self._make_fingerprint(depth)
+            self._memo[key] = fingerprint
+        return fingerprint
+
+    def _make_fingerprint(self, depth: Optional[int]) -> Hashable:
+        raise NotImplementedError
+
+    def _get_state(self) -> Any:
+        raise NotImplementedError
+
+    def _set_state(self, state: Any):
+        raise NotImplementedError
+
+    def _top_terminals(self) -> Tuple[int, ...]:
+        """
+        The distinct terminals on top of the stacks, the end marker left out
+        """
+        terminals = self._memo.get("terminals")
+        if terminals is None:
+            terminals = tuple(
+                symbol
+                for symbol in dict.fromkeys(self.top_symbols())
+                if symbol != CompiledGrammar.END_ID
+            )
+            self._memo["terminals"] = terminals
+        return terminals
+
+    def _finish_lexeme(self) -> bool:
+        """
+        Consume the terminals whose match is complete and end the lexeme. Return False,
+        leaving the state untouched, if none is complete or accepted by the stacks.
+        The state reached is shared with the forks of this state.
+        """
+        memo = self._memo
+        finished = memo.get("finished")
+        if finished is None:
+            dfas = self.grammar.dfas
+            terminals = frozenset(
+                terminal
+                for terminal, state in self._lexeme
+                if dfas[terminal].accepts(state)
+            )
+            finished = False
+            if terminals and self._consume(terminals):
+                finished = (self._get_state(), self._memo)
+            memo["finished"] = finished
+            return finished is not False
+        if finished is False:
+            return False
+        state, self._memo = finished
+        self._set_state(state)
+        self._lexeme = ()
         return True
 
+    def _boundary(self) -> Optional["BaseParser"]:
+        """
+        The parser at the end of the current lexeme, None if it cannot end here
+        """
+        if not self._lexeme:
+            return self
+        parser = self.fork()
+        # pylint: disable-next=protected-access
+        return parser if parser._finish_lexeme() else None
+
+    @property
+    def lexeme(self) -> Lexeme:
+        """
+        The terminals being matched char by char with their DFA states, () between
+        lexemes
+        """
+        return self._lexeme
+
+    def step_lexeme(
+        self, lexeme: Lexeme, char: str
+    ) -> Tuple[Optional["BaseParser"], Lexeme]:
+        """
+        Where char leads from the stacks of this parser with lexeme being matched in
+        place of its own, without building the parser state in between: (None, the
+        lexeme stepped) if char continues some of its terminals, (the parser at the
+        end of lexeme, the lexeme char starts) if it ends there, (None, ()) if char is
+        rejected. This is the lexing of try_add_char, so a trie of strings can be
+        walked along DFA transitions, with a parser state built only once per lexeme
+        that ends: the parsers at the end of each lexeme are kept with this state.
+        """
+        dfas = self.grammar.dfas
+        stepped = []
+        for terminal, state in lexeme:
+            state = dfas[terminal].step(state, char)
+            if state >= 0:
+                stepped.append((terminal, state))
+        if stepped:
+            return None, tuple(stepped)
+
+        parser = self._lexeme_boundary(lexeme)
+        if parser is None:
+            return None, ()
+        started = []
+        for terminal in parser._top_terminals():  # pylint: disable=protected-access
+            state = dfas[terminal].step(0, char)
+            if state >= 0:
+                started.append((terminal, state))
+        if not started:
+            return None, ()
+        return parser, tuple(started)
+
+    def _lexeme_boundary(self, lexeme: Lexeme) -> Optional["BaseParser"]:
+        """
+        The parser at the end of lexeme matched on the stacks of this parser, None if
+        it cannot end there
+        """
+        if not lexeme and not self._lexeme:
+            return self
+        key = ("boundary", lexeme)
+        if key in self._memo:
+            return self._memo[key]
+        if lexeme == self._lexeme:
+            parser = self._boundary()
+        else:
+            parser = self.fork()
+            parser._set_lexeme(lexeme)  # pylint: disable=protected-access
+            # pylint: disable-next=protected-access
+            if lexeme and not parser._finish_lexeme():
+                parser = None
+        self._memo[key] = parser
+        return parser
+
+    def allowed_char_ranges(self) -> CharRanges:
+        """
+        The chars allowed next as sorted (low, high) code point ranges: the chars that
+        continue the lexeme and, if it can end here, the first chars of the terminals
+        allowed after it
+        """
+        ranges = self._memo.get("ranges")
+        if ranges is None:
+            dfas = self.grammar.dfas
+            items = [
+                item
+                for terminal, state in self._lexeme
+                for item in dfas[terminal].char_ranges(state)
+            ]
+            parser = self._boundary()
+            if parser is not None:
+                items.extend(
+                    item
+                    for terminal in parser._top_terminals()  # pylint: disable=protected-access
+                    for item in dfas[terminal].char_ranges(0)
+                )
+            ranges = merge_ranges(items)
+            self._memo["ranges"] = ranges
+        return ranges
+
+    def accepts_end(self) -> bool:
+        parser = self._boundary()
+        return parser is not None and CompiledGrammar.END_ID in parser.top_symbols()
+
     def _get_allowed_next_chars(self):
-        allowed_chars = set()
-        for stack in self.stacks:
-            if isinstance(stack.top(), TerminalElement):
-                allowed_chars.add(stack.top().value)
-            elif isinstance(stack.top(), EndElement):
-                allowed_chars.add("<EOF>")
+        allowed_chars = {
+            chr(code)
+            for low, high in self.allowed_char_ranges()
+            for code in range(low, high + 1)
+        }
+        if self.accepts_end():
+            allowed_chars.add("<EOF>")
         return allowed_chars
 
+    def allowed_next_chars(self) -> Set[str]:
+        """
+        The set of chars allowed next, "<EOF>" standing for the end of input.
+        Regex terminals can allow huge sets of chars, see allowed_char_ranges.
+        """
+        return self._get_allowed_next_chars()
+
+    def _describe_allowed_chars(self) -> str:
+        ranges = self.allowed_char_ranges()
+        if sum(high - low + 1 for low, high in ranges) <= 256:
+            return str(self._get_allowed_next_chars())
+        return format_ranges(ranges) + (" <EOF>" if self.accepts_end() else "")
+
+    def allowed_mask(self, out: Any = None) -> Any:
+        """
+        Fill out[terminal_id] with 1 for every terminal allowed next and 0 otherwise.
+        Index CompiledGrammar.END_ID stands for the end of input.
+        out needs grammar.num_terminals one byte entries (see MaskWriter); a new bytearray
+        is returned when it is omitted.
+        """
+        if out is None:
+            out = bytearray(self.grammar.num_terminals)
+        if self._mask is None or self._mask.out is not out:
+            self._mask = MaskWriter(out)
+        view = self._mask.view
+
+        key = None
+        if self.cache is not None:
+            key = ("mask", self.fingerprint(1))
+            cached = self.cache.get(key)
+            if cached is not None:
+                view[:] = cached
+                return out
+
+        self._mask.clear()
+        for symbol in self.top_symbols():
+            view[symbol] = 1
+
+        if key is not None:
+            self.cache.put(key, bytes(view))
+        return out
+
     def add_char(self, char: str):
+        if not self.try_add_char(char):
+            raise GrammarException("The char is not accepted by the grammar")
+
+    def try_add_char(self, char: str) -> bool:
+        """
+        Consume one char and return True, or return False and leave the state untouched
+        if the grammar does not accept it.
+
+        Terminals are matched by their DFAs (see CompiledGrammar.dfas) and, as in Lark's
+        lexers, the longest match wins: the lexeme ends only when the char does not
+        continue it, and then the terminals it completes are consumed before the char
+        starts the next lexeme.
+        """
+        if self._feed(char) == 0:
+            return False
+        self._print_state()
+        return True
+
+    def add_text(self, text: str):
         """
-        Filter out the stacks that don't start with the char
+        Consume all of text, raising at the first char the grammar does not accept.
+        The chars before it are consumed.
+        """
+        consumed = self.feed(text)
+        if consumed < len(text):
+            raise GrammarException(
+                f"The char {text[consumed]!r} at offset {consumed} is not accepted "
+                "by the grammar"
+            )
+
+    def feed(self, text: str) -> int:
         """
-        self.stacks = [stack for stack in self.stacks if stack.top().value == char]
+        Consume the longest prefix of text the grammar accepts, as try_add_char would
+        char by char, and return its length: len(text) if all of it is accepted, the
+        offset of the first rejected char otherwise, the state being the one before it.
 
-        if len(self.stacks) == 0:
+        The chunk is consumed in one pass: the chars inside a lexeme only step the DFAs
+        of its terminals (a single DFA runs over the text without leaving its loop), and
+        the stacks are advanced, expanded and deduplicated once per lexeme, not per char.
+        """
+        consumed = self._feed(text)
+        if consumed:
+            self._print_state()
+        return consumed
+
+    def feed_chunks(self, chunks: Iterable[str]) -> Iterator[int]:
+        """
+        Feed the chunks in turn, yielding the number of chars consumed from each.
+        Stops after the first chunk that is not consumed entirely.
+        """
+        for chunk in chunks:
+            consumed = self.feed(chunk)
+            yield consumed
+            if consumed < len(chunk):
+                return
+
+    def _feed(self, text: str) -> int:
+        """
+        Consume text up to the first rejected char and return its offset, without
+        printing the state
+        """
+        dfas = self.grammar.dfas
+        lexeme = self._lexeme
+        index = 0
+        while index < len(text):
+            if len(lexeme) == 1:
+                terminal, state = lexeme[0]
+                state, end = dfas[terminal].run(state, text, index)
+                if end > index:
+                    lexeme = ((terminal, state),)
+                    index = end
+                    continue
+                stepped: List[Tuple[int, int]] = []
+            else:
+                char = text[index]
+                stepped = []
+                for terminal, state in lexeme:
+                    state = dfas[terminal].step(state, char)
+                    if state >= 0:
+                        stepped.append((terminal, state))
+
+            if not stepped:
+                self._set_lexeme(lexeme)
+                stepped = self._start_lexeme(text[index])
+                if not stepped:
+                    break
+            lexeme = tuple(stepped)
+            index += 1
+        self._set_lexeme(lexeme)
+        return index
+
+    def _set_lexeme(self, lexeme: Lexeme):
+        if lexeme is not self._lexeme:
+            self._lexeme = lexeme
+            self._memo = {}
+
+    def _start_lexeme(self, char: str) -> List[Tuple[int, int]]:
+        """
+        End the current lexeme and start the next one with char, returning its terminals
+        with their DFA states. Return an empty list, leaving the state untouched, if the
+        lexeme cannot end here or no terminal allowed after it starts with char.
+        """
+        dfas = self.grammar.dfas
+        saved = self.checkpoint()
+        if self._lexeme and not self._finish_lexeme():
+            return []
+        lexeme = []
+        for terminal in self._top_terminals():
+            state = dfas[terminal].step(0, char)
+            if state >= 0:
+                lexeme.append((terminal, state))
+        if not lexeme:
+            self._restore(saved)
+        return lexeme
+
+    def forced_chars(self, limit: int = 256) -> str:
+        """
+        The longest string every live stack agrees on from here: each of its chars is the
+        only one allowed at its position and the input cannot end before it, so it can
+        be appended without asking the model. At most limit chars are looked ahead.
+        """
+        return self._jump(limit)[0]
+
+    def jump_forward(self, limit: int = 256) -> str:
+        """
+        Consume forced_chars(limit) in one call and return them
+        """
+        chars, parser = self._jump(limit)
+        if parser is not self:
+            self.rollback(parser.checkpoint())
+        return chars
+
+    def _jump(self, limit: int) -> Tuple[str, "BaseParser"]:
+        """
+        The forced chars and the parser after them, which is self if there are none
+        """
+        key = ("jump", limit)
+        jump = self._memo.get(key)
+        if jump is None:
+            chars: List[str] = []
+            parser = self
+            while len(chars) < limit:
+                ranges = parser.allowed_char_ranges()
+                if len(ranges) != 1 or ranges[0][0] != ranges[0][1]:
+                    break
+                if parser.accepts_end():
+                    break
+                if parser is self:
+                    parser = self.fork()
+                char = chr(ranges[0][0])
+                if not parser.try_add_char(char):
+                    break
+                chars.append(char)
+            jump = ("".join(chars), parser)
+            self._memo[key] = jump
+        return jump
+
+    def add_terminal(self, terminal: Optional[int]):
+        """
+        Consume one terminal given by its id. The parser state is left untouched when
+        the terminal is rejected.
+        """
+        if self._lexeme:
+            raise GrammarException("A terminal is being matched char by char")
+        if terminal is None or terminal == CompiledGrammar.END_ID:
+            raise GrammarException("The char is not accepted by the grammar")
+        if not self._consume(frozenset((terminal,))):
             raise GrammarException("The char is not accepted by the grammar")
+        self._print_state()
+
+    def _consume(self, terminals: FrozenSet[int]) -> bool:
+        """
+        Pop any of the terminals off the stacks, return False if no stack accepts them
+        """
+        if self.cache is None:
+            accepted = self._advance(terminals)
+        else:
+            key = ("advance", self._stacks_fingerprint(None), terminals)
+            state = self.cache.get(key)
+            if state is not None:
+                self._set_state(state)
+                accepted = True
+            else:
+                accepted = self._advance(terminals)
+                if accepted:
+                    self.cache.put(key, self._get_state())
+
+        if accepted:
+            self._lexeme = ()
+            self._memo = {}
+        return accepted
+
+    def _advance(self, terminals: FrozenSet[int]) -> bool:
+        """
+        Replace the parser state by the one after any of the terminals, return False if no stack accepts them
+        """
+        raise NotImplementedError
+
 
-        for index, stack in enumerate(self.stacks):
-            stack.pop(0)
-
-        for index, stack in enumerate(self.stacks):
-            if isinstance(stack.top(), RuleRefElement):
-                sequences = self.grammar[stack.top()]
-                stack.pop(0)
-                old_stack = copy.deepcopy(stack)
-                # delete the old stack
-                self.stacks.pop(index)
-                for seq in sequences:
-                    new_stack = Stack(seq + old_stack)
-                    # If there is a stack that is equal to the old stack, we don't need to add it again
-                    if new_stack not in self.stacks:
-                        self.stacks.insert(index, new_stack)
+class StackCell:
+    """
+    One symbol of a Parser stack on top of the cell below it, None under the bottom one.
+    Cells are never changed, so stacks pushed onto the same cell share it.
+
+    A cell compares as the stack it tops: its hash is computed once from its symbol and
+    the hash of the cell below, and equality walks down until both stacks reach a
+    shared cell, so stacks built on a common bottom compare in the length of their
+    difference.
+    """
 
+    __slots__ = ("symbol", "below", "_hash")
+
+    def __init__(self, symbol: int, below: Optional["StackCell"]):
+        self.symbol = symbol
+        self.below = below
+        self._hash = hash((symbol, below._hash if below is not None else None))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        cell: Optional[StackCell] = self
+        while cell is not other:
+            if (
+                not isinstance(other, StackCell)
+                or cell is None
+                or cell._hash != other._hash
+                or cell.symbol != other.symbol
+            ):
+                return False
+            cell, other = cell.below, other.below
+        return True
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        The symbols from the top down
+        """
+        cell: Optional[StackCell] = self
+        while cell is not None:
+            yield cell.symbol
+            cell = cell.below
+
+
+class Parser(BaseParser):
+    """
+    A next char predictor using GNF grammar
+
+    The grammar is compiled into integer tables (see CompiledGrammar) and every stack
+    is a linked list of StackCell holding symbol ids, the top being its head.
+
+    Stacks are persistent: a step pops a cell and pushes the production above the cell
+    below it, so the stacks of a state and of the states derived from it share all of
+    their unchanged bottoms, and a state is never modified once built. Within a step,
+    pushing the same symbol onto the same cell twice gives the same cell.
+
+    A non-terminal reaching the top of a stack is not expanded: the next terminal looks
+    up the productions starting with it in the prediction table (see
+    CompiledGrammar.prediction) and only those are pushed. On the LL(1) parts of a
+    grammar a step is then a table lookup and the parser keeps a single stack; only
+    productions sharing their first terminal fork the stack.
+    """
+
+    def __init__(
+        self,
+        grammar: Union[Dict[RuleRefElement, List[Stack]], CompiledGrammar],
+        initial_rule: RuleRefElement,
+        verbose: bool = True,
+        cache: Optional[StateCache] = None,
+    ):
+        super().__init__(grammar, initial_rule, verbose, cache)
+        # a single stack holding the start symbol, expanded by the first terminal
+        self.stacks: List[StackCell] = [StackCell(self.grammar.start_id, None)]
+
+        self._print_state()
+
+    @staticmethod
+    def _push(
+        below: Optional[StackCell],
+        seq: Tuple[int, ...],
+        cells: Dict[Tuple[int, int], StackCell],
+    ) -> StackCell:
+        """
+        The stack with seq, in stack order, pushed onto below. cells holds the cells
+        pushed during the current step by symbol and id of the cell below, which stays
+        alive for the whole step, so pushes of the same symbols onto the same cell share
+        their cells.
+        """
+        for symbol in seq:
+            key = (symbol, id(below))
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = StackCell(symbol, below)
+            below = cell
+        return below
+
+    def _print_state(self):
+        if not self.verbose:
+            return
+        # the stacks once the current lexeme ends, when it can, with the non-terminals
+        # on top expanded as the stacks were before predictions were made lazy
+        stacks = self._expanded_stacks((self._boundary() or self).stacks)
         print("-----------------")
-        print_stacks(self.stacks)
-        print("Number of stacks: ", len(self.stacks))
-        print("Allowed chars: ", self._get_allowed_next_chars())
+        print_stacks([Stack(self.grammar.decode(stack)) for stack in stacks])
+        print("Number of stacks: ", len(stacks))
+        print("Allowed chars: ", self._describe_allowed_chars())
+
+    def _expanded_stacks(self, stacks: List[StackCell]) -> List[Tuple[int, ...]]:
+        """
+        The stacks, top first, with a non-terminal on top replaced by every production
+        its prediction row holds
+        """
+        grammar = self.grammar
+        expanded: Dict[Tuple[int, ...], None] = {}
+        for stack in stacks:
+            if grammar.is_terminal(stack.symbol):
+                expanded[tuple(stack)] = None
+                continue
+            below = tuple(stack.below) if stack.below is not None else ()
+            for seqs in grammar.prediction(stack.symbol).values():
+                for seq in seqs:
+                    expanded[tuple(reversed(seq)) + below] = None
+        return list(expanded)
+
+    def top_symbols(self) -> Iterable[int]:
+        grammar = self.grammar
+        for stack in self.stacks:
+            if grammar.is_terminal(stack.symbol):
+                yield stack.symbol
+            else:
+                # a non-terminal allows the first terminals of its productions
+                yield from grammar.prediction(stack.symbol)
+
+    def _make_fingerprint(self, depth: Optional[int]) -> Hashable:
+        if depth is None:
+            return frozenset(self.stacks)
+        return frozenset(tuple(islice(stack, depth)) for stack in self.stacks)
+
+    def _get_state(self) -> List[StackCell]:
+        return self.stacks
+
+    def _set_state(self, state: List[StackCell]):
+        self.stacks = state
+
+    def _advance(self, terminals: FrozenSet[int]) -> bool:
+        """
+        Pop the terminals off the stacks starting with one of them and replace the
+        non-terminals on top by their productions starting with one of them, without
+        that terminal. The other stacks are filtered out.
+        """
+        grammar = self.grammar
+        cells: Dict[Tuple[int, int], StackCell] = {}
+        # a dict keeps the stacks in order while dropping duplicates in O(1)
+        new_stacks: Dict[StackCell, None] = {}
+        for stack in self.stacks:
+            if grammar.is_terminal(stack.symbol):
+                if stack.symbol in terminals:
+                    new_stacks[stack.below] = None
+                continue
+            row = grammar.prediction(stack.symbol)
+            for terminal in terminals:
+                for seq in row.get(terminal, ()):
+                    new_stacks[self._push(stack.below, seq[:-1], cells)] = None
+
+        if len(new_stacks) == 0:
+            return False
+        self.stacks = list(new_stacks)
+        return True
@@ -0,0 +1,258 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Type, Union
+
+from piu.exceptions.base import GrammarException
+from piu.grammars.cache import StateCache
+from piu.grammars.compiled import CompiledGrammar
+from piu.grammars.grammar_cache import GrammarCache
+from piu.grammars.gss import GSSParser
+from piu.grammars.parser import BaseParser
+from piu.processors.vocabulary import TokenLogitsProcessor, TokenTrie
+
+
+class CompiledEntry:
+    """
+    What the sessions of one grammar share: the compiled grammar, the parser in its
+    initial state that sessions fork, the state cache of those parsers and the token
+    processor reading it. The cache, the processor's mask writer and the states shared
+    by forks are not thread-safe, so every job on them holds lock.
+    """
+
+    def __init__(
+        self,
+        grammar: CompiledGrammar,
+        parser_class: Type[BaseParser],
+        trie: TokenTrie,
+        eos_token_id: Optional[int],
+        cache_entries: int,
+    ):
+        self.grammar = grammar
+        self.cache = StateCache(max_entries=cache_entries)
+        self.initial = parser_class(
+            grammar, grammar.start_symbol, verbose=False, cache=self.cache
+        )
+        self.processor = TokenLogitsProcessor(trie, eos_token_id, self.cache)
+        self.lock = threading.Lock()
+        self.sessions = 0
+
+
+class DecodingSession:
+    """
+    The parser of one generation, forked in O(1) from the initial parser of its
+    grammar. Every call runs as one job on the service executor and a session runs one
+    job at a time, so a session must not be stepped from several coroutines expecting
+    a given order. A cancelled call may still complete in the executor.
+    """
+
+    def __init__(
+        self, service: "DecodingService", entry: CompiledEntry, parser: BaseParser
+    ):
+        self.service = service
+        self.entry = entry
+        self.parser = parser
+        self.closed = False
+        self._lock = asyncio.Lock()
+        entry.sessions += 1
+
+    async def advance(self, text: str) -> int:
+        """
+        Feed the text of a sampled token and return the number of chars consumed
+        (see BaseParser.feed)
+        """
+        return await self._run(self.parser.feed, text)
+
+    async def allowed_token_ids(self) -> List[int]:
+        return await self._run(self.entry.processor.allowed_token_ids, self.parser)
+
+    async def allowed_token_mask(self, out: Any = None) -> Any:
+        """
+        See TokenLogitsProcessor.allowed_token_mask
+        """
+        return await self._run(
+            self.entry.processor.allowed_token_mask, self.parser, out
+        )
+
+    async def step(self, text: str, out: Any = None) -> Any:
+        """
+        Feed the text of a sampled token and return the allowed token mask after it, in
+        a single job. A token the grammar rejects raises GrammarException and leaves the
+        session as it was.
+        """
+        return await self._run(self._step, text, out)
+
+    def _step(self, text: str, out: Any) -> Any:
+        checkpoint = self.parser.checkpoint()
+        consumed = self.parser.feed(text)
+        if consumed < len(text):
+            self.parser.rollback(checkpoint)
+            raise GrammarException(
+                f"The char {text[consumed]!r} at offset {consumed} is not accepted "
+                "by the grammar"
+            )
+        return self.entry.processor.allowed_token_mask(self.parser, out)
+
+    def fork(self) -> "DecodingSession":
+        """
+        A new session in the same state, sharing it until either is stepped
+        """
+        return DecodingSession(self.service, self.entry, self.parser.fork())
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.entry.sessions -= 1
+
+    async def _run(self, function: Callable[..., Any], *args) -> Any:
+        if self.closed:
+            raise GrammarException("The decoding session is closed")
+        async with self._lock:
+            return await self.service.run(self.entry.lock, function, *args)
+
+
+class DecodingService:  # pylint: disable=too-many-instance-attributes
+    """
+    Constrained decoding for many concurrent generations served from one event loop.
+
+    Each grammar is compiled once, through a GrammarCache, even when many sessions ask
+    for it at the same time, and its sessions share the compiled tables, a StateCache
+    and a token processor. Stepping and computing masks run on an executor, a single
+    thread by default, so the event loop never waits for them. At most max_pending
+    jobs are submitted to the executor at once; further calls wait for a slot in the
+    order they came, which is the backpressure on the callers.
+
+    Compiling runs on compile_executor instead, another single thread by default, so a
+    new grammar taking seconds to compile does not hold up the steps of the sessions
+    already open. Compilations take no slot: there is at most one per grammar at once.
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        vocabulary: Union[Sequence[str], TokenTrie],
+        eos_token_id: Optional[int] = None,
+        grammar_cache: Optional[GrammarCache] = None,
+        parser_class: Type[BaseParser] = GSSParser,
+        executor: Optional[Executor] = None,
+        compile_executor: Optional[Executor] = None,
+        max_pending: int = 64,
+        cache_entries: int = 4096,
+    ):
+        if not isinstance(vocabulary, TokenTrie):
+            vocabulary = TokenTrie(vocabulary)
+        self.trie = vocabulary
+        self.eos_token_id = eos_token_id
+        self.grammar_cache = (
+            grammar_cache if grammar_cache is not None else GrammarCache()
+        )
+        self.parser_class = parser_class
+        self.cache_entries = cache_entries
+        self.max_pending = max_pending
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(1, thread_name_prefix="piu")
+        self._own_compile_executor = compile_executor is None
+        self.compile_executor = compile_executor or ThreadPoolExecutor(
+            1, thread_name_prefix="piu-compile"
+        )
+        # created on first use, inside the event loop
+        self._pending: Optional[asyncio.Semaphore] = None
+        # GrammarCache is not thread-safe
+        self._compile_lock = threading.Lock()
+        self._entries: Dict[str, CompiledEntry] = {}
+        self._compiling: Dict[str, "asyncio.Task[CompiledEntry]"] = {}
+        self.jobs = 0
+
+    async def grammar(self, bnf_grammar: str, start: str) -> CompiledEntry:
+        """
+        The shared entry of a grammar, compiled by the first caller while the others
+        wait for it
+        """
+        key = GrammarCache.key(bnf_grammar, start)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        task = self._compiling.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compile(key, bnf_grammar, start))
+            self._compiling[key] = task
+        return await task
+
+    async def _compile(self, key: str, bnf_grammar: str, start: str) -> CompiledEntry:
+        try:
+            entry = await self._submit(
+                self.compile_executor,
+                self._compile_lock,
+                self._make_entry,
+                bnf_grammar,
+                start,
+            )
+            self._entries[key] = entry
+            return entry
+        finally:
+            # a failed compilation is retried by the next caller
+            del self._compiling[key]
+
+    def _make_entry(self, bnf_grammar: str, start: str) -> CompiledEntry:
+        return CompiledEntry(
+            self.grammar_cache.get(bnf_grammar, start),
+            self.parser_class,
+            self.trie,
+            self.eos_token_id,
+            self.cache_entries,
+        )
+
+    async def open_session(self, bnf_grammar: str, start: str) -> DecodingSession:
+        entry = await self.grammar(bnf_grammar, start)
+        return DecodingSession(self, entry, entry.initial.fork())
+
+    async def run(
+        self, lock: threading.Lock, function: Callable[..., Any], *args
+    ) -> Any:
+        """
+        Run function(*args) on the executor holding lock, once a slot is free
+        """
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        async with self._pending:
+            return await self._submit(self.executor, lock, function, *args)
+
+    async def _submit(
+        self,
+        executor: Executor,
+        lock: threading.Lock,
+        function: Callable[..., Any],
+        *args,
+    ) -> Any:
+        self.jobs += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, _run_locked, lock, function, args)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "grammars": len(self._entries),
+            "sessions": sum(entry.sessions for entry in self._entries.values()),
+            "jobs": self.jobs,
+            **self.grammar_cache.stats(),
+        }
+
+    async def close(self):
+        """
+        Wait for the submitted jobs and shut down the executors, except those given
+        """
+        loop = asyncio.get_running_loop()
+        if self._own_executor:
+            await loop.run_in_executor(None, self.executor.shutdown)
+        if self._own_compile_executor:
+            await loop.run_in_executor(None, self.compile_executor.shutdown)
+
+    async def __aenter__(self) -> "DecodingService":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _run_locked(lock: threading.Lock, function: Callable[..., Any], args: tuple) -> Any:
+    with lock:
+        return function(*args)
@@ -0,0 +1,178 @@
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from piu.grammars.cache import StateCache
+from piu.grammars.mask import MaskWriter
+from piu.grammars.parser import BaseParser, Lexeme
+
+
+class TrieNode:
+    __slots__ = ("children", "token_ids")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.token_ids: List[int] = []
+
+
+class TokenTrie:
+    """
+    A prefix trie of a tokenizer vocabulary. Each token id is stored on the node where
+    its string ends, so tokens sharing a prefix share the path to it.
+    """
+
+    def __init__(self, vocabulary: Sequence[str]):
+        self.root = TrieNode()
+        self.size = len(vocabulary)
+        self.max_length = 0
+        for token_id, token in enumerate(vocabulary):
+            if not token:
+                continue
+            node = self.root
+            for char in token:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = TrieNode()
+                node = child
+            node.token_ids.append(token_id)
+            self.max_length = max(self.max_length, len(token))
+
+
+class TokenLogitsProcessor:
+    """
+    Find the tokens of a vocabulary that the grammar accepts from a parser state.
+
+    The vocabulary trie is walked depth first against parser states. Each trie edge is
+    followed only if its char is allowed by the state reached so far, so a prefix
+    shared by many tokens is parsed once and a rejected prefix prunes all the tokens
+    below it. Inside a lexeme an edge only steps the DFAs of its terminals (see
+    BaseParser.step_lexeme); a parser state is forked only where a lexeme ends, once
+    per lexeme and state.
+
+    With a StateCache, results are keyed by the parser fingerprint down to the depth
+    the longest token can reach, so a configuration seen before costs one dict lookup
+    instead of a trie walk.
+
+    A TokenTrie can be given instead of the vocabulary, so processors of different
+    grammars share it.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Union[Sequence[str], TokenTrie],
+        eos_token_id: Optional[int] = None,
+        cache: Optional[StateCache] = None,
+    ):
+        if not isinstance(vocabulary, TokenTrie):
+            vocabulary = TokenTrie(vocabulary)
+        self.trie = vocabulary
+        self.eos_token_id = eos_token_id
+        self.cache = cache
+        self._mask: Optional[MaskWriter] = None
+
+    def _walk(self, parser: BaseParser) -> Iterator[List[int]]:
+        """
+        Yield the token ids of every trie node reachable from the parser state
+        """
+        pending = [(self.trie.root, parser, parser.lexeme)]
+        while pending:
+            node, state, lexeme = pending.pop()
+            for char, child in self._candidate_children(node, state, lexeme):
+                boundary, next_lexeme = state.step_lexeme(lexeme, char)
+                if not next_lexeme:
+                    continue
+                if child.token_ids:
+                    yield child.token_ids
+                if child.children:
+                    pending.append((child, boundary or state, next_lexeme))
+
+    @staticmethod
+    def _candidate_children(
+        node: TrieNode, parser: BaseParser, lexeme: Lexeme
+    ) -> Iterable[Tuple[str, TrieNode]]:
+        """
+        The children of a trie node worth stepping. From the parser's own lexeme (the
+        root) the allowed chars are known, so when they are fewer than the children
+        (literal terminals) only those chars are looked up; elsewhere every child is
+        stepped, which costs a DFA transition or a memoized lexeme boundary
+        """
+        children = node.children
+        if lexeme != parser.lexeme:
+            return children.items()
+        ranges = parser.allowed_char_ranges()
+        if sum(high - low + 1 for low, high in ranges) > len(children):
+            return children.items()
+        return [
+            (chr(code), children[chr(code)])
+            for low, high in ranges
+            for code in range(low, high + 1)
+            if chr(code) in children
+        ]
+
+    def _fingerprint(self, parser: BaseParser) -> Hashable:
+        return parser.fingerprint(2 * self.trie.max_length + 1)
+
+    def _eos_allowed(self, parser: BaseParser) -> bool:
+        return self.eos_token_id is not None and parser.accepts_end()
+
+    def allowed_token_ids(self, parser: BaseParser) -> List[int]:
+        key = None
+        if self.cache is not None:
+            key = ("token_ids", self, self._fingerprint(parser))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return list(cached)
+
+        allowed_token_ids: List[int] = []
+        if self._eos_allowed(parser):
+            allowed_token_ids.append(self.eos_token_id)
+        for token_ids in self._walk(parser):
+            allowed_token_ids.extend(token_ids)
+        allowed_token_ids.sort()
+
+        if key is not None:
+            self.cache.put(key, tuple(allowed_token_ids))
+        return allowed_token_ids
+
+    def allowed_token_mask(self, parser: BaseParser, out: Any = None) -> Any:
+        """
+        Fill out[token_id] with 1 for every token allowed next and 0 otherwise.
+        out needs one byte entry per token id, the EOS id included (see MaskWriter);
+        a new bytearray is returned when it is omitted.
+        """
+        if out is None:
+            size = self.trie.size
+            if self.eos_token_id is not None:
+                size = max(size, self.eos_token_id + 1)
+            out = bytearray(size)
+        if self._mask is None or self._mask.out is not out:
+            self._mask = MaskWriter(out)
+        view = self._mask.view
+
+        key = None
+        if self.cache is not None:
+            key = ("token_mask", self, self._fingerprint(parser))
+            cached = self.cache.get(key)
+            if cached is not None:
+                view[:] = cached
+                return out
+
+        self._mask.clear()
+        if self._eos_allowed(parser):
+            view[self.eos_token_id] = 1
+        for token_ids in self._walk(parser):
+            for token_id in token_ids:
+                view[token_id] = 1
+
+        if key is not None:
+            self.cache.put(key, bytes(view))
+        return out
@@ -1,7 +1,12 @@
+import time
+
 from piu.grammars.converters.bnf.backus import BackusGrammar
 from piu.grammars.converters.cnf.chomsky import ChomskyGrammar
 from piu.grammars.converters.gnf.greibach import GreibachGrammar
+from piu.grammars.converters.hooks import PassSummary, conversion_pass
+from piu.grammars.converters.rule import Rule
 from piu.grammars.converters.utils import print_grammar
+from piu.grammars.element import RuleRefElement
 
 JSON_GRAMMAR = r"""
     value: dict
@@ -22,6 +27,74 @@ JSON_GRAMMAR = r"""
 
     """
 
+
+class RestartingScanGreibachGrammar(GreibachGrammar):
+    """
+    The passes as they were before the rule worklist: every rewrite restarts the scan
+    from the first rule (of the non-terminal, in sort_rules_gnf). Kept to time the
+    worklist against.
+    """
+
+    @conversion_pass
+    def sort_rules_gnf(self):
+        for symbol in sorted(self.mapping, key=self.mapping.__getitem__):
+            while True:
+                for rule in self[symbol]:
+                    first = rule.rhs[0]
+                    if (
+                        isinstance(first, RuleRefElement)
+                        and self.mapping[first] < self.mapping[symbol]
+                    ):
+                        for matched_rule in self[first]:
+                            self.rules.add(
+                                Rule(symbol, matched_rule.rhs + rule.rhs[1:])
+                            )
+                        self.rules.remove(rule)
+                        break
+                else:
+                    break
+            self.remove_left_recursion(symbol)
+
+    @conversion_pass
+    def make_rhs_first_symbol_terminal(self):
+        while True:
+            for rule in self.rules:
+                if isinstance(rule.rhs[0], RuleRefElement):
+                    for cur_rule in self[rule.rhs[0]]:
+                        self.rules.add(Rule(rule.lhs, cur_rule.rhs + rule.rhs[1:]))
+                    self.rules.remove(rule)
+                    break
+            else:
+                break
+
+
+REWRITTEN_PASSES = ("sort_rules_gnf", "make_rhs_first_symbol_terminal")
+
+
+def passes_time(grammar_class, repeat: int = 20):
+    """
+    The fastest of repeat conversions, in seconds, of the whole conversion and of the
+    passes the worklist rewrote, and the last grammar
+    """
+    best_total = best_passes = float("inf")
+    for _ in range(repeat):
+        pass_summary = PassSummary()
+        started = time.perf_counter()
+        converted = grammar_class(
+            cnf.export_grammar(), cnf.start_symbol, hooks=[pass_summary]
+        )
+        best_total = min(best_total, time.perf_counter() - started)
+        best_passes = min(
+            best_passes,
+            sum(
+                totals["seconds"]
+                for (_, name), totals in pass_summary.totals.items()
+                if name in REWRITTEN_PASSES
+            ),
+        )
+    return best_total, best_passes, converted
+
+
 bnf = BackusGrammar(JSON_GRAMMAR, start="value")
 
 print("=====BNF=====")
@@ -41,7 +114,9 @@ print_grammar(cnf.export_grammar())
 
 print("=====GNF=====")
 
+start_time = time.perf_counter()
 gnf = GreibachGrammar(cnf.export_grammar(), cnf.start_symbol)
+gnf_time = time.perf_counter() - start_time
 
 for function_name, grammar in gnf.grammar_timeline:
     print(f"======{function_name}======")
@@ -50,3 +125,33 @@ for function_name, grammar in gnf.grammar_timeline:
 
 
 print_grammar(gnf.export_grammar())
+
+print(f"GNF conversion: {gnf_time * 1000:.2f} ms, {len(gnf.rules)} rules")
+
+worklist_total, worklist_passes, worklist_gnf = passes_time(GreibachGrammar)
+restarting_total, restarting_passes, restarting_gnf = passes_time(
+    RestartingScanGreibachGrammar
+)
+print(
+    f"GNF worklist: {worklist_total * 1000:.2f} ms "
+    f"({worklist_passes * 1000:.2f} ms in the rewritten passes), "
+    f"restarting scan: {restarting_total * 1000:.2f} ms "
+    f"({restarting_passes * 1000:.2f} ms), "
+    f"same rules: {set(worklist_gnf.rules) == set(restarting_gnf.rules)}"
+)
+
+for strategy in GreibachGrammar.STRATEGIES:
+    start_time = time.perf_counter()
+    strategy_gnf = GreibachGrammar(
+        cnf.export_grammar(), cnf.start_symbol, strategy=strategy
+    )
+    strategy_time = time.perf_counter() - start_time
+    print(
+        f"GNF {strategy}: {strategy_time * 1000:.2f} ms, {len(strategy_gnf.rules)} rules"
+    )
+
+print("=====PASSES=====")
+
+summary = PassSummary()
+GreibachGrammar(cnf.export_grammar(), cnf.start_symbol, hooks=[summary])
+print(summary)